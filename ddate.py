@@ -4,76 +4,219 @@
 #
 # If no argument, converts the current date.
 # If argument in Gregorian ISO format of YYYY-MM-DD, converts that date.
+#
+# Bulk mode converts many dates in one process, printing "<date>\t<ddate>"
+# lines for ISO dates read from stdin (--stdin) or every date of a --range,
+# or adding a "discordian" column after a --column of a CSV file (--csv, - for
+# stdin). Dates are looked up in tables of the Discordian day of each
+# Gregorian day of year, built once for common and leap years. With --numpy
+# (if NumPy is installed), stdin and ranges are converted as datetime64
+# arrays. --bench prints the throughput of each path.
+#
+# Importable as a module:
+#   ddate(date)        "Mungday, Chaos 5, 3190 YOLD" of a datetime.date
+#   ddates(dates)      the same for an iterable of dates or ISO strings
+#   ddate_array(dates) array of the same for an array of datetime64
+#
+# Usage:
+#   $ ddate.py 2024-01-05
+#   $ ddate.py --range 2024-01-01 2024-12-31
+#   $ cut -d, -f3 report.csv | ddate.py --stdin
+#   $ ddate.py --csv report.csv --column date > annotated.csv
+#   $ ddate.py --bench 1000000
 
+import argparse
 import calendar
+import csv
 import datetime
+import random
 import sys
+import time
+
+# Seasons with their apostle holyday (day 5) and season holyday (day 50)
+SEASONS = [("Chaos", "Mungday", "Chaoflux"),
+           ("Discord", "Mojoday", "Discoflux"),
+           ("Confusion", "Syaday", "Confluflux"),
+           ("Bureaucracy", "Zaraday", "Bureflux"),
+           ("The Aftermath", "Maladay", "Afflux")]
+
+
+def day_names(leap):
+    """ Return Discordian day of each Gregorian day of year, from 1 """
+    names = [""]
+    for day_of_year in range(1, 366 + leap):
+        if leap and day_of_year == 60:
+            names.append("St. Tib's Day")
+            continue
+        if leap and day_of_year > 60:
+            day_of_year -= 1
+        season, day = divmod(day_of_year - 1, 73)
+        name, apostle, flux = SEASONS[season]
+        text = f"{name} {day + 1}"
+        if day + 1 == 5:
+            text = f"{apostle}, {text}"
+        elif day + 1 == 50:
+            text = f"{flux}, {text}"
+        names.append(text)
+    return names
+
+
+# Lookup tables, indexed [leap][day of year]
+DAYS = (day_names(False), day_names(True))
+
+
+def import_numpy():
+    """ Return NumPy, or None if it isn't installed; only imported when used,
+        as it takes longer than the rest of a run """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def ddate(date):
+    """ Return Discordian date of datetime.date """
+    year = date.year
+    day_of_year = date.toordinal() - datetime.date(year, 1, 1).toordinal() + 1
+    return f"{DAYS[calendar.isleap(year)][day_of_year]}, {year + 1166} YOLD"
+
+
+def ddates(dates):
+    """ Yield Discordian dates of datetime.dates or ISO date strings """
+    starts = {}
+    for date in dates:
+        if isinstance(date, str):
+            date = datetime.date.fromisoformat(date.strip())
+        year = date.year
+        if year not in starts:
+            starts[year] = (datetime.date(year, 1, 1).toordinal() - 1,
+                            DAYS[calendar.isleap(year)], f", {year + 1166} YOLD")
+        start, names, yold = starts[year]
+        yield names[date.toordinal() - start] + yold
+
+
+def ddate_array(dates):
+    """ Return array of Discordian dates of datetime64 array """
+    import numpy
+
+    dates = numpy.asarray(dates, dtype="datetime64[D]")
+    years = dates.astype("datetime64[Y]")
+    day_of_year = (dates - years).astype(numpy.int64) + 1
+    year = years.astype(numpy.int64) + 1970
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    # Format each distinct (year, day of year) once, then index by it
+    key = (year * 2 + leap) * 367 + day_of_year
+    unique, inverse = numpy.unique(key, return_inverse=True)
+    names = numpy.array([f"{DAYS[k // 367 % 2][k % 367]}, {k // 734 + 1166} YOLD"
+                         for k in unique.tolist()])
+    return names[inverse.reshape(dates.shape)]
+
+
+def date_range(start, end):
+    """ Yield dates from start to end, inclusive """
+    for ordinal in range(start.toordinal(), end.toordinal() + 1):
+        yield datetime.date.fromordinal(ordinal)
+
+
+def annotate_csv(infile, outfile, column):
+    """ Copy CSV, adding a discordian column after column (name or number),
+        empty where the date is missing or invalid """
+    reader = csv.reader(infile)
+    writer = csv.writer(outfile)
+    header = next(reader)
+    index = int(column) - 1 if column.isdigit() else header.index(column)
+    header.insert(index + 1, "discordian")
+    writer.writerow(header)
+    for row in reader:
+        try:
+            discordian = ddate(datetime.date.fromisoformat(row[index].strip()))
+        except (IndexError, ValueError):
+            discordian = ""
+        row.insert(index + 1, discordian)
+        writer.writerow(row)
+
+
+def bench(count):
+    """ Print dates/s of each conversion path over count random dates """
+    numpy = import_numpy()
+    rng = random.Random(0)
+    first = datetime.date(1900, 1, 1).toordinal()
+    dates = [datetime.date.fromordinal(first + rng.randrange(73049))
+             for _ in range(count)]
+    isos = [date.isoformat() for date in dates]
+    paths = [("ddate", lambda: [ddate(date) for date in dates]),
+             ("ddates", lambda: list(ddates(dates))),
+             ("ddates iso", lambda: list(ddates(isos)))]
+    if numpy:
+        array = numpy.array(isos, dtype="datetime64[D]")
+        paths.append(("ddate_array", lambda: ddate_array(array)))
+        paths.append(("ddate_array iso",
+                      lambda: ddate_array(numpy.array(isos, dtype="datetime64[D]"))))
+    for name, run in paths:
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        print(f"{name:>16} {count / elapsed:>12,.0f} dates/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert Gregorian dates to Discordian")
+    parser.add_argument("date",
+                        help="ISO date, YYYY-MM-DD (default: today).",
+                        nargs="?",
+                        type=datetime.date.fromisoformat)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--stdin",
+                      action="store_true",
+                      help="Convert ISO dates read from stdin, one per line.")
+    mode.add_argument("--range",
+                      help="Convert every date from START to END.",
+                      metavar=("START", "END"),
+                      nargs=2,
+                      type=datetime.date.fromisoformat)
+    mode.add_argument("--csv",
+                      help="Add discordian column to CSV file, - for stdin.")
+    mode.add_argument("--bench",
+                      help="Print throughput over COUNT random dates.",
+                      metavar="COUNT",
+                      type=int)
+    parser.add_argument("--column",
+                        help="CSV column of dates, by name or number from 1.")
+    parser.add_argument("--numpy",
+                        action="store_true",
+                        help="Convert --stdin or --range as NumPy arrays.")
+    args = parser.parse_args()
+    if args.csv and not args.column:
+        parser.error("--csv requires --column")
+    numpy = import_numpy() if args.numpy else None
+    if args.numpy and not numpy:
+        parser.error("--numpy requires NumPy")
+
+    if args.bench:
+        bench(args.bench)
+    elif args.csv:
+        infile = sys.stdin if args.csv == "-" else open(args.csv, newline="")
+        with infile:
+            annotate_csv(infile, sys.stdout, args.column)
+    elif args.stdin or args.range:
+        if args.numpy and args.stdin:
+            dates = numpy.array(sys.stdin.read().split(), dtype="datetime64[D]")
+        elif args.numpy:
+            dates = numpy.arange(args.range[0], args.range[1] + datetime.timedelta(1),
+                                 dtype="datetime64[D]")
+        elif args.stdin:
+            dates = [line.strip() for line in sys.stdin if line.strip()]
+        else:
+            dates = list(date_range(*args.range))
+        converted = ddate_array(dates) if args.numpy else ddates(dates)
+        sys.stdout.writelines(f"{date}\t{discordian}\n"
+                              for date, discordian in zip(dates, converted))
+    else:
+        discordian = ddate(args.date or datetime.datetime.today())
+        print(f"Today is {discordian}.")
+
 
-# Date to convert
-if len(sys.argv) > 1:
-    gregorian = datetime.date.fromisoformat(sys.argv[1])
-else:
-    gregorian = datetime.datetime.today()
-
-# Variables
-day_of_year = gregorian.timetuple().tm_yday
-year = gregorian.year + 1166
-season = ""
-day = ""
-holyday = ""
-leap = False
-
-# Leap year
-if calendar.isleap(gregorian.year):
-    leap = True
-    if day_of_year > 60:
-        day_of_year -= 1
-
-# Calculate
-if leap and day_of_year == 60:
-    season = ""
-    day = ""
-    holyday = "St. Tib's Day"
-elif day_of_year <= 73:
-    season = "Chaos"
-    day = str(day_of_year)
-    if day_of_year == 5:
-        holyday = "Mungday"
-    if day_of_year == 50:
-        holyday = "Chaoflux"
-elif day_of_year <= 146:
-    season = "Discord"
-    day = str(day_of_year % 73)
-    if day_of_year == 78:
-        holyday = "Mojoday"
-    if day_of_year == 123:
-        holyday = "Discoflux"
-elif day_of_year <= 219:
-    season = "Confusion"
-    day = str(day_of_year % 146)
-    if day_of_year == 151:
-        holyday = "Syaday"
-    if day_of_year == 196:
-        holyday = "Confluflux"
-elif day_of_year <= 292:
-    season = "Bureaucracy"
-    day = str(day_of_year % 219)
-    if day_of_year == 224:
-        holyday = "Zaraday"
-    if day_of_year == 269:
-        holyday = "Bureflux"
-elif day_of_year <= 365:
-    season = "The Aftermath"
-    day = str(day_of_year % 292)
-    if day_of_year == 297:
-        holyday = "Maladay"
-    if day_of_year == 342:
-        holyday = "Afflux"
-
-# Print
-if season == "":
-    print(f"Today is {holyday}, {year} YOLD.")
-elif holyday != "":
-    print(f"Today is {holyday}, {season} {day}, {year} YOLD.")
-else:
-    print(f"Today is {season} {day}, {year} YOLD.")
+if __name__ == "__main__":
+    main()
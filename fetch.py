@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+#
+# HTTP layer shared by the scrapers (fweet.py, rss-items.py, scrape-mises.py,
+# wikiquote.py), imported from the same directory:
+#
+#   fetcher = fetch.Fetcher(rate=2, concurrency=4, cache_dir=...)
+#   r = fetcher.get(url)
+#   fetcher.metrics.report()
+#
+# - keep-alive sessions, one per thread
+# - per host, at most `concurrency` requests in flight (a streamed response
+#   holds its slot until closed) and at most `rate` requests per second
+# - connection errors, timeouts, 429 and 5xx are retried up to `retries`
+#   times, waiting `backoff` seconds doubled on each attempt (or as long as
+#   a 429/503's Retry-After says)
+# - with a `cache_dir`, bodies of GET responses with an ETag or Last-Modified
+#   are stored on disk and revalidated with If-None-Match/If-Modified-Since;
+#   a 304 is answered from the cache, as is any request within `max_age`
+#   seconds of the last one, or a failed one with stale_on_error. The
+#   response's from_cache is then "fresh", "revalidated" or "stale" (None
+#   for a response from the network). Streamed responses aren't cached.
+# - metrics of every request: status, attempts, latency, bytes, cache use
+#   (a 304 counts as a cache hit, whichever cache the validators came from);
+#   a long-running caller reports and then resets them now and again
+#
+# Requirements:
+#   requests
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import requests
+
+# Statuses worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Response headers kept in the cache
+CACHED_HEADERS = ["Content-Type", "ETag", "Last-Modified"]
+
+
+def cache_home(name):
+    """ Return directory name under $XDG_CACHE_HOME """
+    return os.path.join(os.environ.get("XDG_CACHE_HOME")
+                        or os.path.expanduser("~/.cache"), name)
+
+
+class RateLimiter:
+    """ Space out calls to wait() across threads to rate per second """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next - now
+            self.next = max(now, self.next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Metrics:
+    """ Record of each request, added to across threads """
+
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+
+    def add(self, url, method="GET"):
+        record = {"url": url, "method": method, "status": None,
+                  "attempts": 0, "seconds": 0.0, "bytes": 0,
+                  "cache": None, "error": None}
+        with self.lock:
+            self.records.append(record)
+        return record
+
+    def reset(self):
+        """ Forget requests so far, returning their records """
+        with self.lock:
+            records, self.records = self.records, []
+        return records
+
+    def summary(self):
+        """ Return totals of requests """
+        with self.lock:
+            records = list(self.records)
+        latencies = sorted(r["seconds"] for r in records if r["attempts"])
+        return {
+            "requests": len(records),
+            "retries": sum(max(0, r["attempts"] - 1) for r in records),
+            "errors": sum(1 for r in records if r["error"]),
+            "cache_hits": sum(1 for r in records if r["cache"]),
+            "bytes": sum(r["bytes"] for r in records),
+            "seconds": round(sum(latencies), 3),
+            "median_seconds": round(latencies[len(latencies) // 2], 3)
+                              if latencies else 0,
+            "max_seconds": round(latencies[-1], 3) if latencies else 0,
+        }
+
+    def report(self, file=sys.stderr):
+        s = self.summary()
+        print(f"{s['requests']} requests ({s['cache_hits']} from cache, "
+              f"{s['retries']} retries, "
+              f"{s['errors']} errors), {s['bytes'] / 1e6:.1f} MB, "
+              f"latency median {s['median_seconds'] * 1000:.0f} ms, "
+              f"max {s['max_seconds'] * 1000:.0f} ms", file=file)
+
+
+class Fetcher:
+    """ Pooled, rate-limited, retrying, caching HTTP client """
+
+    def __init__(self, rate=0, concurrency=4, retries=3, backoff=1.0,
+                 timeout=60, cache_dir=None, max_age=0, headers=None):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.headers = headers or {}
+        self.metrics = Metrics()
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def session(self):
+        """ Return this thread's session """
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+            self.local.session.headers.update(self.headers)
+        return self.local.session
+
+    def host(self, url):
+        """ Return (concurrency semaphore, rate limiter) of url's host """
+        netloc = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            if netloc not in self.hosts:
+                self.hosts[netloc] = (
+                    threading.BoundedSemaphore(self.concurrency),
+                    RateLimiter(self.rate))
+            return self.hosts[netloc]
+
+    def request(self, method, url, headers=None, stream=False, **kwargs):
+        """ Return response of request, retried and recorded in metrics """
+        slots, limiter = self.host(url)
+        record = self.metrics.add(url, method)
+        started = time.monotonic()
+        try:
+            for attempt in range(self.retries + 1):
+                record["attempts"] += 1
+                limiter.wait()
+                slots.acquire()
+                held = False
+                try:
+                    r = self.session().request(method, url, headers=headers,
+                                               stream=stream,
+                                               timeout=self.timeout, **kwargs)
+                    if (r.status_code not in RETRY_STATUSES
+                            or attempt == self.retries):
+                        # A streamed response keeps its slot until closed
+                        held = stream
+                        break
+                    r.close()
+                    delay = self.backoff * 2 ** attempt
+                    retry_after = r.headers.get("Retry-After", "")
+                    if retry_after.isdigit():
+                        delay = int(retry_after)
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt == self.retries:
+                        raise
+                    delay = self.backoff * 2 ** attempt
+                finally:
+                    if not held:
+                        slots.release()
+                time.sleep(delay)
+        except requests.RequestException as e:
+            record["error"] = str(e)
+            e.record = record
+            raise
+        finally:
+            record["seconds"] = time.monotonic() - started
+        record["status"] = r.status_code
+        if r.status_code == 304:
+            record["cache"] = "revalidated"
+        r.record = record
+        r.from_cache = None
+        if stream:
+            self.track(r, record, slots)
+        else:
+            record["bytes"] = len(r.content)
+        return r
+
+    def track(self, r, record, slots):
+        """ Count bytes of streamed response, release slot on close """
+        iter_content = r.iter_content
+        close = r.close
+        released = []
+
+        def counted(*args, **kwargs):
+            for chunk in iter_content(*args, **kwargs):
+                record["bytes"] += len(chunk)
+                yield chunk
+
+        def release():
+            close()
+            if not released:
+                released.append(True)
+                slots.release()
+
+        r.iter_content = counted
+        r.close = release
+
+    def get(self, url, headers=None, stream=False, stale_on_error=False):
+        """ Return response of GET request, via the cache if any """
+        if not self.cache_dir or stream:
+            return self.request("GET", url, headers, stream)
+        path = os.path.join(self.cache_dir,
+                            hashlib.sha256(url.encode()).hexdigest())
+        try:
+            with open(path + ".json") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+        if entry and time.time() - entry["fetched"] < self.max_age:
+            self.metrics.add(url)["cache"] = "fresh"
+            return self.cached(entry, path, "fresh")
+        headers = dict(headers or {})
+        if entry and entry["headers"].get("ETag"):
+            headers["If-None-Match"] = entry["headers"]["ETag"]
+        if entry and entry["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+        try:
+            r = self.request("GET", url, headers)
+        except requests.RequestException as e:
+            if entry and stale_on_error:
+                e.record["cache"] = "stale"
+                return self.cached(entry, path, "stale")
+            raise
+        if r.status_code == 304 and entry:
+            entry["fetched"] = time.time()
+            self.store(path, entry)
+            return self.cached(entry, path, "revalidated")
+        if r.status_code == 200 and (r.headers.get("ETag")
+                                     or r.headers.get("Last-Modified")
+                                     or self.max_age):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.replace(path + ".body", r.content)
+            self.store(path, {
+                "url": url,
+                "fetched": time.time(),
+                "headers": {name: r.headers[name] for name in CACHED_HEADERS
+                            if name in r.headers},
+            })
+        return r
+
+    def store(self, path, entry):
+        self.replace(path + ".json", json.dumps(entry).encode())
+
+    def replace(self, path, data):
+        """ Write data to path atomically, via a temporary file of its own so
+            concurrent requests for a URL don't clash """
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def cached(self, entry, path, how):
+        """ Return response made of cache entry """
+        r = requests.Response()
+        r.status_code = 200
+        r.url = entry["url"]
+        r.headers = requests.structures.CaseInsensitiveDict(entry["headers"])
+        r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+        with open(path + ".body", "rb") as f:
+            r._content = f.read()
+        r._content_consumed = True
+        r.record = None
+        r.from_cache = how
+        return r
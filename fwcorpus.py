@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+#
+# Compact corpus of the Finnegans Wake text scraped by fweet.py, written by it
+# next to the .txt and .csv, with lines addressed by page.line reference
+#
+# The file holds a header (first page, number of pages, line slots per page),
+# a fixed-width table of (offset, length) of every page.line slot, and the
+# UTF-8 texts of all lines in one blob. It's memory-mapped, so a line is found
+# in constant time, and a span of lines reads one run of the table, without
+# parsing or scanning anything. --txt and --csv write fweet.py's text and CSV
+# files from it, byte for byte.
+#
+# Importable as a module:
+#   with fwcorpus.Corpus("finneganswake.fwc") as corpus:
+#       corpus.line("412.07")             text of a line
+#       corpus.span("412.07", "413.02")   [(ref, text), ...] of a range
+#       corpus.pages(412, 413)            the same for whole pages
+#   fwcorpus.write(path, rows)            write corpus of (ref, text) rows
+#
+# Usage:
+#   $ fwcorpus.py 412.07
+#   $ fwcorpus.py 412.07 413.02
+#   $ fwcorpus.py 412
+#   $ fwcorpus.py --txt finneganswake.txt --csv finneganswake.csv
+#   $ fwcorpus.py --build finneganswake.csv
+
+import argparse
+import array
+import csv
+import mmap
+import os
+import struct
+import sys
+
+corpus_file = "finneganswake.fwc"
+
+# Header: magic, first page, number of pages, line slots per page (line
+# numbers from 0); followed by (offset, length) of each slot in the blob, in
+# page.line order, and the blob of line texts
+HEADER = struct.Struct("<4sIII")
+MAGIC = b"FWC1"
+
+# Length of an empty slot, a line number the page doesn't have
+MISSING = 0xFFFFFFFF
+
+
+def parse_ref(ref):
+    """ Return (page, line) of "PPP.LL" reference, line None if only page """
+    page, dot, line = str(ref).partition(".")
+    return int(page), int(line) if dot else None
+
+
+def format_ref(page, line):
+    return f"{page:03d}.{line:02d}"
+
+
+def write(path, rows):
+    """ Write corpus of (page_line, line_text) rows to path """
+    parsed = []
+    for ref, text in rows:
+        page, line = parse_ref(ref)
+        if line is None or format_ref(page, line) != ref:
+            raise ValueError(f"unsupported reference: {ref!r}")
+        parsed.append((page, line, text.encode()))
+    first = min((page for page, _, _ in parsed), default=0)
+    count = max((page for page, _, _ in parsed), default=first - 1) - first + 1
+    width = max((line for _, line, _ in parsed), default=-1) + 1
+    table = array.array("I", [0, MISSING]) * (count * width)
+    blob = bytearray()
+    for page, line, text in parsed:
+        slot = 2 * ((page - first) * width + line)
+        if table[slot + 1] != MISSING:
+            raise ValueError(f"duplicate reference: {format_ref(page, line)}")
+        table[slot] = len(blob)
+        table[slot + 1] = len(text)
+        blob += text
+    if sys.byteorder != "little":
+        table.byteswap()
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, first, count, width))
+        table.tofile(f)
+        f.write(blob)
+    os.replace(path + ".tmp", path)
+
+
+class Corpus:
+    """ Memory-mapped corpus file """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.first, self.count, self.width = HEADER.unpack_from(self.mm)
+        end = HEADER.size + 8 * self.count * self.width
+        if magic != MAGIC or len(self.mm) < end:
+            self.mm.close()
+            raise ValueError(f"{path}: not a corpus file")
+        table = memoryview(self.mm)[HEADER.size:end].cast("I")
+        self.table = table if sys.byteorder == "little" else table.tolist()
+        self.blob = end
+
+    def close(self):
+        if isinstance(self.table, memoryview):
+            self.table.release()
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def slot(self, page, line):
+        """ Return table index of page.line, clamped to the corpus """
+        line = min(max(line, 0), self.width)
+        index = (page - self.first) * self.width + line
+        return min(max(index, 0), self.count * self.width)
+
+    def text(self, slot):
+        """ Return text of slot, or None if empty """
+        offset, length = self.table[2 * slot], self.table[2 * slot + 1]
+        if length == MISSING:
+            return None
+        start = self.blob + offset
+        return self.mm[start:start + length].decode()
+
+    def line(self, ref):
+        """ Return text of "PPP.LL" line; KeyError if there's none """
+        page, line = parse_ref(ref)
+        text = None
+        if (line is not None and 0 <= page - self.first < self.count
+                and 0 <= line < self.width):
+            text = self.text((page - self.first) * self.width + line)
+        if text is None:
+            raise KeyError(ref)
+        return text
+
+    def span(self, start, end):
+        """ Return [(ref, text)] of lines from start to end, inclusive """
+        start_page, start_line = parse_ref(start)
+        end_page, end_line = parse_ref(end)
+        first = self.slot(start_page, start_line or 0)
+        last = (self.slot(end_page, end_line + 1) if end_line is not None
+                else self.slot(end_page + 1, 0))
+        rows = []
+        for slot in range(first, last):
+            text = self.text(slot)
+            if text is not None:
+                page, line = divmod(slot, self.width)
+                rows.append((format_ref(page + self.first, line), text))
+        return rows
+
+    def pages(self, first, last=None):
+        """ Return [(ref, text)] of lines of pages first to last """
+        return self.span(first, first if last is None else last)
+
+    def __iter__(self):
+        return iter(self.span(self.first, self.first + self.count - 1))
+
+
+def export_txt(corpus, f):
+    """ Write fweet.py's text file of corpus to f """
+    for ref, text in corpus:
+        f.write(ref + " " + text + "\n")
+
+
+def export_csv(corpus, f):
+    """ Write fweet.py's CSV file of corpus to f """
+    csv.writer(f, delimiter=",", quoting=csv.QUOTE_ALL).writerows(corpus)
+
+
+def read_csv(path):
+    """ Return (page_line, line_text) rows of fweet.py CSV file """
+    with open(path, newline="") as f:
+        return [(page_line, line_text)
+                for page_line, line_text in csv.reader(f)]
+
+
+def export(path, how, corpus):
+    """ Write text or CSV export of corpus to path, - for stdout """
+    if path == "-":
+        how(corpus, sys.stdout)
+        return
+    with open(path + ".tmp", "w", newline="") as f:
+        how(corpus, f)
+    os.replace(path + ".tmp", path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Read lines of Finnegans Wake corpus from fweet.py")
+    parser.add_argument("start",
+                        help="Reference of line (PPP.LL) or page (PPP).",
+                        nargs="?")
+    parser.add_argument("end",
+                        help="Print lines from start to this line or page.",
+                        nargs="?")
+    parser.add_argument("--corpus",
+                        default=corpus_file,
+                        help=f"Corpus file (default: {corpus_file}).")
+    parser.add_argument("--txt",
+                        help="Write fweet.py text file, - for stdout.",
+                        metavar="FILE")
+    parser.add_argument("--csv",
+                        help="Write fweet.py CSV file, - for stdout.",
+                        metavar="FILE")
+    parser.add_argument("--build",
+                        help="Write corpus from fweet.py CSV file first.",
+                        metavar="CSV")
+    args = parser.parse_args()
+    if not (args.start or args.txt or args.csv or args.build):
+        parser.error("reference, --txt, --csv or --build required")
+
+    if args.build:
+        write(args.corpus, read_csv(args.build))
+    with Corpus(args.corpus) as corpus:
+        if args.txt:
+            export(args.txt, export_txt, corpus)
+        if args.csv:
+            export(args.csv, export_csv, corpus)
+        if args.start:
+            if args.end is None and parse_ref(args.start)[1] is not None:
+                try:
+                    rows = [(args.start, corpus.line(args.start))]
+                except KeyError:
+                    sys.exit(f"{args.start}: no such line")
+            else:
+                rows = corpus.span(args.start, args.end or args.start)
+            for ref, text in rows:
+                print(ref + " " + text)
+
+
+if __name__ == "__main__":
+    main()
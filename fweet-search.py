@@ -0,0 +1,270 @@
+#!/usr/bin/python
+#
+# Searches the Finnegans Wake text scraped by fweet.py, via a local index
+#
+# The index (built from finneganswake.csv, or the --corpus file, on first use,
+# and again whenever that is newer) holds the lines keyed by their page.line
+# reference, an inverted index of lowercased words, and a character-trigram
+# index. Queries are case-insensitive:
+#   - word:   lines containing the word
+#   - prefix: lines containing a word starting with the prefix
+#   - regex:  lines matching the regular expression; only lines whose
+#             trigrams include those of the pattern's literal runs are tried
+#
+# Lines are searched together with the following line, as Joyce's words
+# routinely span line breaks: each line is joined to the next one with a
+# space, and a line ending in "-" also without the hyphen (and the joined
+# word is indexed); a regex is tried on the line alone and on both joins, so
+# it finds whatever grep does and more. A match starting on a line prints
+# both lines when it runs over.
+#
+# Usage:
+#   $ fweet-search.py riverrun
+#   $ fweet-search.py --prefix commod -C 1
+#   $ fweet-search.py --regex "vicus\s+of"
+#   $ fweet-search.py --build
+
+import argparse
+import array
+import bisect
+import csv
+import os
+import pickle
+import re
+import sys
+import time
+
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+input_csv = "finneganswake.csv"
+index_file = "finneganswake.idx"
+
+# Changed when the index layout does, to rebuild older indexes
+INDEX_VERSION = 2
+
+# Words: letters/digits with inner apostrophes, e.g. "adam's"
+WORD = re.compile(r"\w+(?:['’]\w+)*")
+
+
+def windows(lines, i):
+    """ Return [(text, where line i ends)] of line i alone, joined to the next
+        line with a space, and without the hyphen if line i ends in one """
+    line = lines[i]
+    if i + 1 == len(lines):
+        return [(line, len(line))]
+    joined = [(line, len(line)), (line + " " + lines[i + 1], len(line))]
+    if line.endswith("-"):
+        joined.append((line[:-1] + lines[i + 1], len(line) - 1))
+    return joined
+
+
+def joined_word(lines, i):
+    """ Return lowercased word hyphenated across end of line i, or None """
+    if not lines[i].endswith("-") or i + 1 == len(lines):
+        return None
+    head = WORD.findall(lines[i])
+    tail = WORD.findall(lines[i + 1])
+    if (not head or not tail or not lines[i][:-1].endswith(head[-1])
+            or not lines[i + 1].startswith(tail[0])):
+        return None
+    return (head[-1] + tail[0]).lower()
+
+
+def trigrams(text):
+    """ Return set of lowercased character trigrams of text """
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def read_lines(path):
+    """ Return refs and texts of lines of fweet.py CSV or corpus file """
+    refs = []
+    lines = []
+    if path.endswith(".fwc"):
+        import fwcorpus
+
+        with fwcorpus.Corpus(path) as corpus:
+            rows = list(corpus)
+    else:
+        with open(path, newline="") as f:
+            rows = list(csv.reader(f))
+    for page_line, line_text in rows:
+        refs.append(page_line)
+        lines.append(line_text)
+    return refs, lines
+
+
+def build(path):
+    """ Return index of fweet.py CSV or corpus file """
+    refs, lines = read_lines(path)
+    words = {}
+    grams = {}
+    for i, line in enumerate(lines):
+        tokens = {word.lower() for word in WORD.findall(line)}
+        joined = joined_word(lines, i)
+        if joined:
+            tokens.add(joined)
+        for word in tokens:
+            words.setdefault(word, array.array("I")).append(i)
+        for gram in set().union(*(trigrams(text)
+                                  for text, _ in windows(lines, i))):
+            grams.setdefault(gram, array.array("I")).append(i)
+    return {"version": INDEX_VERSION,
+            "refs": refs, "lines": lines, "words": words,
+            "vocab": sorted(words), "trigrams": grams}
+
+
+def load(path, source):
+    """ Return index at path, (re)building it from source if stale """
+    if (not os.path.exists(path)
+            or os.path.getmtime(path) < os.path.getmtime(source)):
+        index = build(source)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+        return index
+    with open(path, "rb") as f:
+        index = pickle.load(f)
+    if index.get("version") != INDEX_VERSION:
+        os.remove(path)
+        return load(path, source)
+    return index
+
+
+def literals(pattern):
+    """ Return lowercased literal runs every match of pattern contains """
+    runs = [[]]
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return []
+    for op, value in parsed:
+        if op is sre_parse.LITERAL:
+            runs[-1].append(chr(value).lower())
+        elif op is sre_parse.BRANCH:
+            return []
+        else:
+            runs.append([])
+    return ["".join(run) for run in runs if len(run) >= 3]
+
+
+def search_words(index, words):
+    """ Return {line: end line} of lines containing any of words """
+    hits = {}
+    for word in words:
+        for i in index["words"].get(word, ()):
+            joined = word == joined_word(index["lines"], i)
+            hits[i] = max(hits.get(i, i), i + 1 if joined else i)
+    return hits
+
+
+def search_prefix(index, prefix):
+    """ Return {line: end line} of lines with a word starting with prefix """
+    vocab = index["vocab"]
+    start = bisect.bisect_left(vocab, prefix)
+    end = bisect.bisect_left(vocab, prefix + "\U0010ffff")
+    return search_words(index, vocab[start:end])
+
+
+def search_regex(index, pattern):
+    """ Return {line: end line} of lines where a match of pattern starts """
+    regex = re.compile(pattern, re.IGNORECASE)
+    lines = index["lines"]
+    candidates = None
+    for run in literals(pattern):
+        for gram in trigrams(run):
+            postings = set(index["trigrams"].get(gram, ()))
+            candidates = (postings if candidates is None
+                          else candidates & postings)
+    hits = {}
+    for i in sorted(candidates) if candidates is not None else range(len(lines)):
+        for text, end in windows(lines, i):
+            for match in regex.finditer(text):
+                if match.start() >= end:
+                    break
+                hits[i] = max(hits.get(i, i),
+                              i + 1 if match.end() > end else i)
+    return hits
+
+
+def show(index, hits, context):
+    """ Print hit lines with context, grep-style groups separated by -- """
+    last = None
+    for i in sorted(hits):
+        first = max(0, i - context)
+        end = min(len(index["lines"]) - 1, hits[i] + context)
+        if last is not None and first > last + 1:
+            print("--")
+        for j in range(max(first, last + 1 if last is not None else 0),
+                       end + 1):
+            print(index["refs"][j] + " " + index["lines"][j])
+        last = max(end, last if last is not None else end)
+
+
+def main():
+    """ Parse arguments, load index, run query, print matches. """
+    parser = argparse.ArgumentParser(
+        description="Search Finnegans Wake text from fweet.py")
+    parser.add_argument("query",
+                        help="Word, prefix or regex to search for.",
+                        nargs="?")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("-p",
+                      "--prefix",
+                      action="store_true",
+                      help="Match words starting with query.")
+    mode.add_argument("-r",
+                      "--regex",
+                      action="store_true",
+                      help="Query is a regular expression.")
+    parser.add_argument("-C",
+                        "--context",
+                        default=0,
+                        help="Lines of context around matches.",
+                        type=int)
+    parser.add_argument("--csv",
+                        default=input_csv,
+                        help=f"fweet.py CSV file (default: {input_csv}).")
+    parser.add_argument("--corpus",
+                        help="Build index from fweet.py corpus file "
+                             "(see fwcorpus.py) instead of the CSV.")
+    parser.add_argument("--index",
+                        default=index_file,
+                        help=f"Index file (default: {index_file}).")
+    parser.add_argument("--build",
+                        action="store_true",
+                        help="Rebuild index.")
+    parser.add_argument("--time",
+                        action="store_true",
+                        help="Print load and query times to stderr.")
+    args = parser.parse_args()
+    if args.query is None and not args.build:
+        parser.error("query required")
+
+    started = time.perf_counter()
+    if args.build and os.path.exists(args.index):
+        os.remove(args.index)
+    index = load(args.index, args.corpus or args.csv)
+    loaded = time.perf_counter()
+    if args.query is None:
+        print(f"{len(index['lines'])} lines, {len(index['vocab'])} words, "
+              f"{len(index['trigrams'])} trigrams in {args.index}")
+        return
+    if args.regex:
+        hits = search_regex(index, args.query)
+    elif args.prefix:
+        hits = search_prefix(index, args.query.lower())
+    else:
+        hits = search_words(index, [args.query.lower()])
+    searched = time.perf_counter()
+    show(index, hits, args.context)
+    if args.time:
+        print(f"{len(hits)} lines, load {(loaded - started) * 1000:.1f} ms, "
+              f"query {(searched - loaded) * 1000:.1f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,40 +6,250 @@
 # 003.02 of bay, brings us by a commodius vicus of recirculation back to
 # 003.03 Howth Castle and Environs.
 #
-# Note: at 2 seconds/page, will take 1,250 seconds or ~21 min. to complete.
+# Note: at 2 seconds/page, will take 1,250 seconds or ~21 min. to complete
+# one page at a time.
+#
+# Pages are fetched by a pool of --workers threads through fetch.py, with
+# keep-alive sessions and retries, and all requests share a --rate limit
+# (requests per second) to stay polite. --base-url points the crawl at
+# another fw_grep.cgi, e.g. a local stand-in for testing.
+#
+# Each finished page is appended to a checkpoint journal (one JSON line of
+# page and rows, flushed and fsync'ed) as soon as it's parsed, whatever the
+# order. A rerun after an interruption only fetches pages missing from the
+# journal; a torn last line is ignored. The .txt and .csv are then rewritten
+# from the journal in page.line order, so nothing is duplicated. --fresh
+# discards the journal and fetches everything again.
+#
+# The lines are also written to a compact corpus file, read by page.line in
+# constant time via fwcorpus.py, which can also write the .txt and .csv again.
+#
+# --save-html keeps each fetched page in a directory, so that after a change
+# to the extraction, --from-html can redo it from the saved pages instead of
+# fetching them again: they're parsed with lxml and XPath (no BeautifulSoup
+# tree) in a pool of --workers processes, and the journal and outputs are
+# rewritten.
+#
+# --metrics-json appends a summary of time spent fetching, parsing,
+# extracting and writing, with page/line counts, to a file; --profile runs
+# under cProfile or tracemalloc (see metrics.py).
+#
+# Usage:
+#   $ fweet.py
+#   $ fweet.py --workers 8 --rate 4
+#   $ fweet.py --fresh --metrics-json runs.jsonl
+#   $ fweet.py --save-html pages/ && fweet.py --from-html pages/
 
+import argparse
+import concurrent.futures
 import csv
+import json
 import os
-import requests
-import sys
 
 from bs4 import BeautifulSoup
 
+import fetch
+import fwcorpus
+import metrics
+
 first_page = 3
 last_page = 628
 output_txt = "finneganswake.txt"
 output_csv = "finneganswake.csv"
+output_corpus = fwcorpus.corpus_file
+journal = "finneganswake.pages.jsonl"
 
 # - Example for requesting page 23:
 # - fweet.org/cgi-bin/fw_grep.cgi?regex=1&showtxt=1&hideelu=1&srch=^023
-base_url = "http://www.fweet.org/cgi-bin/fw_grep.cgi" + \
-           "?regex=1&showtxt=1&hideelu=1&srch=^"
-
-with open(output_txt, "a") as t, open(output_csv, "a", newline="") as c:
-    csvwriter = csv.writer(c, delimiter=",", quoting=csv.QUOTE_ALL)
-    # Iterate through each page
-    for page in range(first_page, last_page + 1):
-        # Make soup, target relevant table
-        url = base_url + str(page).zfill(3)
-        html = requests.get(url)
-        soup = BeautifulSoup(html.text, "html.parser")
-        table = soup.find_all("table")[1]
-        trs = table.find_all("tr")
-        print(str(page).zfill(3))
-        for tr in trs:
-            # Write to file
-            page_line = tr.find("th").text.strip()
-            line_text = tr.find("td").text.strip()
-            t.write(page_line + " " + line_text + "\n")
-            csvwriter.writerow([page_line, line_text])
+base_url = "http://www.fweet.org/cgi-bin/fw_grep.cgi"
+query = "?regex=1&showtxt=1&hideelu=1&srch=^"
+
+
+def parse_page(html):
+    """ Return [page_line, line_text] rows of fw_grep.cgi page """
+    return extract_rows(BeautifulSoup(html, "html.parser"))
+
+
+def extract_rows(soup):
+    """ Return [page_line, line_text] rows of parsed fw_grep.cgi page """
+    table = soup.find_all("table")[1]
+    rows = []
+    for tr in table.find_all("tr"):
+        page_line = tr.find("th").text.strip()
+        line_text = tr.find("td").text.strip()
+        rows.append([page_line, line_text])
+    return rows
+
+
+def extract_file(path):
+    """ Return (page, rows) of fw_grep.cgi page saved at path, via lxml """
+    import lxml.html
+
+    with open(path, encoding="utf-8") as f:
+        doc = lxml.html.document_fromstring(f.read())
+    rows = []
+    for tr in doc.xpath("(//table)[2]//tr"):
+        page_line = tr.xpath(".//th")[0].text_content().strip()
+        line_text = tr.xpath(".//td")[0].text_content().strip()
+        rows.append([page_line, line_text])
+    return int(os.path.basename(path).split(".")[0]), rows
+
+
+def extract_saved(directory, pages, workers):
+    """ Yield (page, rows) of pages saved in directory, parsed in processes """
+    paths = [os.path.join(directory, f"{page:03d}.html") for page in pages]
+    paths = [path for path in paths if os.path.exists(path)]
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        yield from pool.map(extract_file, paths, chunksize=16)
+
+
+def load_journal(path):
+    """ Return {page: rows} of complete lines in checkpoint journal """
+    done = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                done[entry["page"]] = entry["rows"]
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def write_outputs(done):
+    """ Rewrite text, CSV and corpus files from {page: rows}, in page order """
+    with open(output_txt + ".tmp", "w") as t, \
+            open(output_csv + ".tmp", "w", newline="") as c:
+        csvwriter = csv.writer(c, delimiter=",", quoting=csv.QUOTE_ALL)
+        for page in sorted(done):
+            for page_line, line_text in done[page]:
+                t.write(page_line + " " + line_text + "\n")
+                csvwriter.writerow([page_line, line_text])
+    os.replace(output_txt + ".tmp", output_txt)
+    os.replace(output_csv + ".tmp", output_csv)
+    try:
+        fwcorpus.write(output_corpus, [row for page in sorted(done)
+                                       for row in done[page]])
+    except ValueError as e:
+        print(f"{output_corpus} not written: {e}")
+
+
+def crawl(pages, url, workers, fetcher, run, save_html=None):
+    """ Yield (page, rows) of pages as they finish, fetched concurrently """
+
+    def fetch_page(page):
+        with run.stage("fetch"):
+            html = fetcher.get(url + str(page).zfill(3))
+            html.raise_for_status()
+        if save_html:
+            with run.stage("write"), open(os.path.join(
+                    save_html, f"{page:03d}.html"), "w", encoding="utf-8") as f:
+                f.write(html.text)
+        with run.stage("parse"):
+            soup = BeautifulSoup(html.text, "html.parser")
+        with run.stage("extract"):
+            return extract_rows(soup)
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        futures = {pool.submit(fetch_page, page): page for page in pages}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def main():
+    """ Parse arguments, crawl pages, write text and CSV files. """
+    parser = argparse.ArgumentParser(
+        description="Scrape Finnegans Wake from fweet.org")
+    parser.add_argument("-w",
+                        "--workers",
+                        default=4,
+                        help="Concurrent page requests (default: 4).",
+                        type=int)
+    parser.add_argument("-r",
+                        "--rate",
+                        default=2.0,
+                        help="Max requests per second, 0 for no limit "
+                             "(default: 2).",
+                        type=float)
+    parser.add_argument("--base-url",
+                        default=base_url,
+                        help="fw_grep.cgi URL (default: fweet.org).")
+    parser.add_argument("--first",
+                        default=first_page,
+                        help=f"First page (default: {first_page}).",
+                        type=int)
+    parser.add_argument("--last",
+                        default=last_page,
+                        help=f"Last page (default: {last_page}).",
+                        type=int)
+    parser.add_argument("--fresh",
+                        action="store_true",
+                        help="Discard checkpoint journal, fetch all pages.")
+    parser.add_argument("--save-html",
+                        help="Also save fetched pages to this directory.",
+                        metavar="DIR")
+    parser.add_argument("--from-html",
+                        help="Extract pages saved by --save-html in this "
+                             "directory instead of fetching them.",
+                        metavar="DIR")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    with metrics.measure("fweet", args) as run:
+        scrape(args, run)
+
+
+def scrape(args, run):
+    """ Crawl pages missing from journal, write text and CSV files. """
+    if args.fresh and os.path.exists(journal):
+        os.remove(journal)
+    done = load_journal(journal)
+    pages = [page for page in range(args.first, args.last + 1)
+             if page not in done]
+    if args.from_html:
+        with run.stage("extract"):
+            for page, rows in extract_saved(
+                    args.from_html, range(args.first, args.last + 1),
+                    args.workers):
+                done[page] = rows
+                run.count("pages")
+                run.count("lines", len(rows))
+        pages = []
+        print(f"{run.counts.get('pages', 0)} pages from {args.from_html}")
+    elif done:
+        print(f"{len(done)} pages in {journal}, {len(pages)} to fetch")
+    # Rewrite journal without a torn last line before appending to it
+    with open(journal + ".tmp", "w") as j:
+        for page, rows in done.items():
+            j.write(json.dumps({"page": page, "rows": rows}) + "\n")
+    os.replace(journal + ".tmp", journal)
+    fetcher = fetch.Fetcher(rate=args.rate, concurrency=args.workers)
+    run.attach("fetch", fetcher.metrics.summary)
+    with open(journal, "a") as j:
+        if args.save_html:
+            os.makedirs(args.save_html, exist_ok=True)
+        for page, rows in crawl(pages, args.base_url + query, args.workers,
+                                fetcher, run, args.save_html):
+            with run.stage("write"):
+                j.write(json.dumps({"page": page, "rows": rows}) + "\n")
+                j.flush()
+                os.fsync(j.fileno())
+            done[page] = rows
+            run.count("pages")
+            run.count("lines", len(rows))
+            print(str(page).zfill(3))
+    if not args.from_html:
+        fetcher.metrics.report()
+    with run.stage("write"):
+        write_outputs({page: rows for page, rows in done.items()
+                       if args.first <= page <= args.last})
+
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+#
+# Benchmarks iapd.py on synthetic feeds from iapd-gen.py
+#
+# For each feed size, generates the feed once (kept in --dir for later runs),
+# then runs iapd.py with each engine and worker count, recording wall time,
+# MB/s, firms/s and peak RSS of the iapd.py process (and its workers).
+# Results are printed as a table and, with --results, appended as JSON lines
+# so regressions in the extraction path can be tracked over time.
+#
+# Usage:
+#   $ iapd-bench.py --sizes 10M 100M 1G
+#   $ iapd-bench.py --sizes 100M --engines table --workers 1 4 \
+#         --results bench.jsonl
+
+import argparse
+import datetime
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IAPD = os.path.join(HERE, "iapd.py")
+IAPD_GEN = os.path.join(HERE, "iapd-gen.py")
+
+
+def feed(directory, size, seed):
+    """ Return path of synthetic feed of size, generating it if missing """
+    path = os.path.join(directory, f"iapd-{size}-{seed}.xml")
+    if not os.path.isfile(path):
+        print(f"Generating {path}", file=sys.stderr)
+        subprocess.run([sys.executable, IAPD_GEN, "--size", size,
+                        "--seed", str(seed), path + ".tmp"], check=True)
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def run(path, engine, workers):
+    """ Return (seconds, firms scanned, peak RSS KB) of one iapd.py run """
+    output = os.path.join(os.path.dirname(path), "bench-output.csv")
+    started = time.monotonic()
+    proc = subprocess.Popen([sys.executable, IAPD, "--stats",
+                             "--engine", engine, "--workers", str(workers),
+                             path, output],
+                            stderr=subprocess.PIPE)
+    stderr = proc.stderr.read().decode()
+    # wait4() gives the rusage of this child alone, which covers the
+    # iapd.py process; its pool workers report their peak via --stats
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.monotonic() - started
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    os.remove(output)
+    if proc.returncode:
+        sys.exit(f"iapd.py failed:\n{stderr}")
+    firms = int(re.search(r"(\d+) firms scanned", stderr).group(1))
+    rss = re.search(r"peak RSS ([\d.]+) MB", stderr)
+    peak = max(usage.ru_maxrss, float(rss.group(1)) * 1024 if rss else 0)
+    return elapsed, firms, peak
+
+
+def main():
+    """ Parse arguments, run benchmarks, print results. """
+    parser = argparse.ArgumentParser(description="Benchmark iapd.py")
+    parser.add_argument("--sizes",
+                        default=["10M"],
+                        help="Feed sizes to generate (default: 10M).",
+                        nargs="+")
+    parser.add_argument("--engines",
+                        default=["bigxml", "table"],
+                        help="iapd.py engines to run (default: both).",
+                        nargs="+")
+    parser.add_argument("--workers",
+                        default=[1],
+                        help="Worker counts to run (default: 1).",
+                        nargs="+",
+                        type=int)
+    parser.add_argument("--seed",
+                        default=0,
+                        help="Feed random seed (default: 0).",
+                        type=int)
+    parser.add_argument("--dir",
+                        default=".",
+                        help="Directory for generated feeds (default: .).")
+    parser.add_argument("--results",
+                        help="Append results to this JSON lines file.")
+    args = parser.parse_args()
+
+    print(f"{'size':>6} {'engine':>7} {'workers':>7} {'seconds':>8} "
+          f"{'MB/s':>7} {'firms/s':>8} {'RSS MB':>7}")
+    for size in args.sizes:
+        path = feed(args.dir, size, args.seed)
+        megabytes = os.path.getsize(path) / 1e6
+        for engine in args.engines:
+            for workers in args.workers:
+                elapsed, firms, peak = run(path, engine, workers)
+                result = {
+                    "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "size": size,
+                    "bytes": os.path.getsize(path),
+                    "firms": firms,
+                    "engine": engine,
+                    "workers": workers,
+                    "seconds": round(elapsed, 3),
+                    "mb_per_sec": round(megabytes / elapsed, 2),
+                    "firms_per_sec": round(firms / elapsed),
+                    "peak_rss_mb": round(peak / 1024, 1),
+                }
+                print(f"{size:>6} {engine:>7} {workers:>7} "
+                      f"{result['seconds']:>8.2f} {result['mb_per_sec']:>7.2f} "
+                      f"{result['firms_per_sec']:>8} "
+                      f"{result['peak_rss_mb']:>7.1f}")
+                if args.results:
+                    with open(args.results, "a") as f:
+                        f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+#
+# Generates synthetic IAPD 'SEC Investment Advisers' XML for benchmarking
+# iapd.py without downloading the real feed.
+#
+# Firms follow the IAPDFirmSECReport/Firms/Firm layout of the SEC file, with
+# the elements iapd.py reads (Info, MainAddr, NoticeFiled/States and Part1A
+# Item1, Item3A, Item5A-5G, Item6A, Item7A) plus the surrounding elements and
+# attributes it skips, so the parser does a realistic amount of work. About
+# half the firms offer financial planning (Item5G Q5G1="Y"), some omit
+# optional elements, and names include escaped and non-ASCII characters.
+#
+# Usage:
+#   $ iapd-gen.py --size 100M feed.xml
+#   $ iapd-gen.py --size 1G --seed 7 - | gzip > feed.xml.gz
+#
+# Prints the number of firms written to stderr.
+
+import argparse
+import random
+import sys
+
+# Feed header and footer
+HEAD = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<IAPDFirmSECReport GenOn="2023-06-01">\n'
+        '<Firms>\n')
+TAIL = "</Firms>\n</IAPDFirmSECReport>\n"
+
+# Value pools
+STATES = ["AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "DC", "FL", "GA",
+          "HI", "ID", "IL", "IN", "IA", "KS", "KY", "LA", "ME", "MD", "MA",
+          "MI", "MN", "MS", "MO", "MT", "NE", "NV", "NH", "NJ", "NM", "NY",
+          "NC", "ND", "OH", "OK", "OR", "PA", "PR", "RI", "SC", "SD", "TN",
+          "TX", "UT", "VT", "VA", "WA", "WV", "WI", "WY"]
+CITIES = ["NEW YORK", "BOSTON", "CHICAGO", "HOUSTON", "DALLAS", "MIAMI",
+          "SAN FRANCISCO", "LOS ANGELES", "DENVER", "SEATTLE", "ATLANTA",
+          "GREENWICH", "PHILADELPHIA", "SAN JUAN", "CORAL GABLES"]
+ORG_TYPES = ["Limited Liability Company", "Corporation", "Limited Partnership",
+             "Partnership", "Sole Proprietorship", "Other"]
+WORDS = ["CAPITAL", "ASSET", "WEALTH", "ADVISORS", "MANAGEMENT", "PARTNERS",
+         "INVESTMENT", "GROUP", "FINANCIAL", "GLOBAL", "STRATEGIES", "TRUST",
+         "SMITH &amp; JONES", "MÜLLER", "BLUE RIDGE", "SUMMIT", "HARBOR"]
+REGIONS = ["NYRO", "BRO", "CHRO", "DERO", "FWRO", "LARO", "MIRO", "PHRO",
+           "SFRO", "ATRO", "SLRO"]
+
+
+def parse_size(text):
+    """ Return bytes of size like "100M" or "1G" """
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    if text[-1:].upper() in units:
+        return int(float(text[:-1]) * units[text[-1:].upper()])
+    return int(text)
+
+
+def yn(rng, p=0.5):
+    """ Return "Y" with probability p, else "N" """
+    return "Y" if rng.random() < p else "N"
+
+
+def amount(rng, scale):
+    """ Return log-uniform integer up to about scale, as string """
+    return str(int(10 ** (rng.random() * scale)))
+
+
+def firm(rng, crd):
+    """ Return XML of one <Firm> """
+    name = " ".join(rng.sample(WORDS, rng.randint(2, 4)))
+    state = rng.choice(STATES)
+    parts = [
+        "<Firm>\n",
+        f'<Info SECRgnCD="{rng.choice(REGIONS)}" FirmCrdNb="{crd}" '
+        f'SECNb="801-{rng.randint(10000, 129999)}" BusNm="{name}" '
+        f'LegalNm="{name} LLC" UmbrRgstn="{yn(rng, 0.05)}"/>\n',
+        f'<MainAddr Strt1="{rng.randint(1, 9999)} MAIN STREET" '
+        f'Strt2="SUITE {rng.randint(100, 3000)}" City="{rng.choice(CITIES)}" '
+        f'State="{state}" Cntry="United States" '
+        f'PostlCd="{rng.randint(10000, 99999)}" '
+        f'PhNb="{rng.randint(200, 999)}-555-{rng.randint(1000, 9999)}"/>\n',
+        f'<Rgstn FirmType="Registered" St="APPROVED" '
+        f'Dt="{rng.randint(1990, 2023)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}"/>\n',
+    ]
+    if rng.random() < 0.8:
+        parts.append("<NoticeFiled>")
+        for notice in rng.sample(STATES, rng.randint(1, 12)):
+            parts.append(f'<States RgltrCd="{notice}" St="FILED" '
+                         f'Dt="2022-0{rng.randint(1, 9)}-01"/>')
+        parts.append("</NoticeFiled>\n")
+    parts.append(f'<Filing Dt="2023-0{rng.randint(1, 5)}-{rng.randint(10, 28)}" '
+                 f'FormVrsn="10/2021"/>\n')
+    parts.append("<FormInfo><Part1A>")
+    parts.append(f'<Item1 Q1F5="{rng.randint(0, 40)}" Q1I="{yn(rng, 0.6)}" '
+                 f'Q1M="{yn(rng, 0.05)}" Q1N="{yn(rng, 0.02)}" '
+                 f'Q1O="{yn(rng, 0.1)}" Q1ODesc="Between $1 billion and less '
+                 f'than $10 billion" Q1P="{rng.randint(100000, 999999)}"/>')
+    parts.append(f'<Item2A Q2A1="{yn(rng, 0.9)}" Q2A2="N" Q2A4="N" Q2A5="N" '
+                 f'Q2A6="N" Q2A7="N" Q2A8="N" Q2A9="N" Q2A10="N" Q2A11="N" '
+                 f'Q2A12="N" Q2A13="N"/>')
+    if rng.random() < 0.97:
+        parts.append(f'<Item3A OrgFormNm="{rng.choice(ORG_TYPES)}"/>')
+    parts.append(f'<Item3B Q3B="DECEMBER"/><Item3C StateCD="{state}" '
+                 f'CntryNm="United States"/>')
+    parts.append(f'<Item5A TtlEmp="{rng.randint(1, 2000)}"/>')
+    parts.append(f'<Item5B Q5B1="{rng.randint(0, 500)}" '
+                 f'Q5B2="{rng.randint(0, 100)}" Q5B3="{rng.randint(0, 50)}" '
+                 f'Q5B4="0" Q5B5="0" Q5B6="0"/>')
+    parts.append("<Item5D " + " ".join(
+        f'Q5D{letter}1="{rng.randint(0, 5000)}" Q5D{letter}3="{amount(rng, 10)}"'
+        for letter in "ABFHM") + ' Q5DN1="0" Q5DN3="0"/>')
+    parts.append("<Item5E " + " ".join(
+        f'Q5E{i}="{yn(rng, p)}"'
+        for i, p in enumerate([0.95, 0.3, 0.05, 0.6, 0.1, 0.2, 0.1], 1))
+        + "/>")
+    parts.append(f'<Item5F Q5F1="Y" Q5F2A="{amount(rng, 11)}" '
+                 f'Q5F2B="{amount(rng, 9)}" Q5F2C="{amount(rng, 11)}" '
+                 f'Q5F2D="{rng.randint(0, 20000)}" '
+                 f'Q5F2E="{rng.randint(0, 2000)}" '
+                 f'Q5F2F="{rng.randint(0, 22000)}" Q5F3="{amount(rng, 8)}"/>')
+    parts.append("<Item5G " + " ".join(
+        f'Q5G{i}="{yn(rng, 0.5 if i == 1 else 0.2)}"' for i in range(1, 13))
+        + "/>")
+    parts.append("<Item6A " + " ".join(
+        f'Q6A{i}="{yn(rng, 0.05)}"' for i in range(1, 15)) + "/>")
+    parts.append("<Item7A " + " ".join(
+        f'Q7A{i}="{yn(rng, 0.1)}"' for i in range(1, 17)) + "/>")
+    parts.append("</Part1A></FormInfo>\n</Firm>\n")
+    return "".join(parts)
+
+
+def main():
+    """ Parse arguments, write firms until size is reached. """
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic IAPD XML feed")
+    parser.add_argument("output",
+                        help="Output XML file, or - for stdout.")
+    parser.add_argument("-s",
+                        "--size",
+                        default="10M",
+                        help="Approximate output size, e.g. 10M, 100M, 1G "
+                             "(default: 10M).")
+    parser.add_argument("--seed",
+                        default=0,
+                        help="Random seed (default: 0).",
+                        type=int)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    target = parse_size(args.size) - len(HEAD) - len(TAIL)
+    out = (sys.stdout.buffer if args.output == "-"
+           else open(args.output, "wb"))
+    written = firms = 0
+    try:
+        out.write(HEAD.encode())
+        while written < target:
+            data = firm(rng, 100000 + firms).encode()
+            out.write(data)
+            written += len(data)
+            firms += 1
+        out.write(TAIL.encode())
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    print(f"{firms} firms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -37,24 +37,125 @@
 #       q5f2D - discretionary accounts
 #       q5f2E - non-discretionary accounts
 #       q5f2F - total accounts
+#
+# Usage:
+#   $ iapd.py IA_FIRM_SEC_Feed.xml output.csv
+#   $ iapd.py --workers 8 IA_FIRM_SEC_Feed.xml output.csv
+#
+#   The input may also be .gz, .xz or .zip (first .xml member), read as a
+#   stream without unpacking to disk, or "-" for stdin. --progress SECONDS
+#   prints bytes read, firms/sec and an ETA to stderr at that interval
+#   (ETA is based on the compressed size, so needs a file rather than a pipe).
+#   $ curl -s https://.../IA_FIRM_SEC_Feed.xml.gz | iapd.py --progress 5 - out.csv
+#
+#   --workers N splits the XML at <Firm> boundaries into byte ranges, parses
+#   the ranges in N processes and writes the rows back in original order, so
+#   the CSV is identical to a single-process run. Needs an uncompressed file.
+#
+#   --engine table skips bigxml's per-element Python dispatch: one TABLE maps
+#   (element path, attribute) to output field, expat (C) streams the file and
+#   firms are held in __slots__ Records. Output is the same as --engine bigxml.
+#
+#   --stats prints firms/sec and peak RSS to stderr, e.g. to compare engines:
+#   $ iapd.py --stats --engine bigxml feed.xml a.csv
+#   $ iapd.py --stats --engine table feed.xml b.csv
+#
+#   --diff PREVIOUS writes only firms added, removed or changed since PREVIOUS,
+#   which is either the previous XML feed or a --snapshot file of an earlier
+#   run. Firms are keyed by CRD number (SEC number if missing) and compared by
+#   a hash of their output row; the CSV gets leading "Change" and CRD columns.
+#   $ iapd.py --snapshot 2023-06.snap feed-2023-06.xml full.csv
+#   $ iapd.py --diff 2023-06.snap --snapshot 2023-07.snap \
+#         feed-2023-07.xml churn.csv
+#
+#   --format sqlite writes a SQLite database instead of CSV: table "firms" with
+#   counts and dollar amounts stored as integers ("" and "n/a" as NULL), child
+#   table "notices" with one row per notice filing state, and indexes on
+#   state, org type, AUM and notice state. e.g.
+#   $ iapd.py --format sqlite feed.xml iapd.db
+#   $ sqlite3 iapd.db "SELECT name FROM firms
+#         WHERE state = 'TX' AND aum_total_dollars > 1000000000"
+#
+#   Filters select the firms written (default: --advisory Y, as before):
+#   --state, --org-type and --notice may be repeated, --min-aum and
+#   --max-aum bound total AUM in dollars. With --engine table each filter is
+#   tested as soon as its element is parsed, and the rest of a rejected firm
+#   is skipped without extracting it. --stats shows firms scanned vs written.
+#   $ iapd.py --engine table --state TX --state OK --min-aum 1000000000 \
+#         feed.xml tx-ok.csv
+#
+#   --metrics-json FILE appends a JSON summary of the run to FILE: seconds
+#   spent loading --diff, parsing (waiting on workers with --workers),
+#   extracting rows and writing, firms scanned/written and input bytes.
+#   --profile cpu|memory runs it under cProfile or tracemalloc (metrics.py).
+#   $ iapd.py --metrics-json runs.jsonl --engine table feed.xml out.csv
 
 
+import argparse
+import concurrent.futures
+import contextlib
 import csv
 import dataclasses
+import datetime
+import gzip
+import hashlib
+import lzma
+import mmap
+import os
+import re
+import resource
+import sqlite3
 import sys
+import time
+import xml.parsers.expat
+import zipfile
 
 import bigxml
 
+import metrics
+
 # Local path to "SEC Investment Advisers" XML file and output CSV file
 # (Download XML file from here: https://adviserinfo.sec.gov/compilation)
 INPUT_FILE = "IA_FIRM_SEC_Feed_11_06_2022.xml"
 OUTPUT_FILE = "output.csv"
 
+# Start tag of a <Firm> element (but not <Firms>) and end of the firm list
+FIRM_TAG = re.compile(rb"<Firm[\s/>]")
+FIRMS_END = b"</Firms>"
+
+# Byte ranges per worker; more ranges than workers evens out the load
+SHARDS_PER_WORKER = 4
+
+# Bytes fed to expat at a time by the table engine
+CHUNK_SIZE = 1 << 20
+
+# Firms inserted per SQLite transaction
+BATCH_SIZE = 1000
+
+# Leading bytes of compressed inputs
+MAGIC = {
+    "gzip": b"\x1f\x8b",
+    "xz": b"\xfd7zXZ\x00",
+    "zip": b"PK\x03\x04",
+}
+
+# Path of <Firm> elements from the document root
+FIRM_PATH = ("IAPDFirmSECReport", "Firms", "Firm")
+
+# First row of a --snapshot file
+SNAPSHOT_HEADER = ["Firm: CRD", "Hash"]
+
+
+class InputError(ValueError):
+    """ Input or --diff file that can't be read as given """
+
 
 @bigxml.xml_handle_element("IAPDFirmSECReport", "Firms", "Firm")
 @dataclasses.dataclass
 class Entry:
     name: str = ""
+    crd: str = ""
+    sec_number: str = ""
     city: str = ""
     state: str = ""
     notices: str = ""
@@ -94,6 +195,10 @@ class Entry:
     def business_name(self, node):
         if "BusNm" in node.attributes:
             self.name = node.attributes["BusNm"]
+        if "FirmCrdNb" in node.attributes:
+            self.crd = node.attributes["FirmCrdNb"]
+        if "SECNb" in node.attributes:
+            self.sec_number = node.attributes["SECNb"]
 
     @bigxml.xml_handle_element("MainAddr")
     def headquarters(self, node):
@@ -197,77 +302,660 @@ class Entry:
             self.industry_trust = node.attributes["Q7A9"]
 
 
-with open(sys.argv[2], "w") as w:
-    writer = csv.writer(w, delimiter=",", quotechar='"', quoting=csv.QUOTE_ALL)
-    with open(sys.argv[1], "rb") as f:
-        writer.writerow(["Firm: Name"]
-                        + ["Firm: Notices"]
-                        + ["Firm: Org type"]
-                        + ["Firm: # Offices"]
-                        + ["Firm: # Employees"]
-                        + ["Firm: HQ State"]
-                        + ["Firm: HQ City"]
-                        + ["Clients: Indiv"]
-                        + ["Clients: Indiv AUM"]
-                        + ["Clients: HNW"]
-                        + ["Clients: HNW AUM"]
-                        + ["Clients: Charitable"]
-                        + ["Clients: Charitable AUM"]
-                        + ["Clients: Corporate"]
-                        + ["Clients: Corporate AUM"]
-                        + ["Financil planning?"]
-                        + ["Comp: %"]
-                        + ["Comp: Hourly"]
-                        + ["Comp: Subscription"]
-                        + ["Comp: Fixed"]
-                        + ["Comp: Commission"]
-                        + ["Comp: Performance"]
-                        + ["Comp: Other"]
-                        + ["AUM: Discretionary"]
-                        + ["AUM: Discretionary AUM"]
-                        + ["AUM: Non-discretionary"]
-                        + ["AUM: Non-discretionary AUM"]
-                        + ["AUM: Total"]
-                        + ["AUM: Total AUM"]
-                        + ["Industry: Has Trust Co."]
-                        + ["Industry: Broker-dealer"]
-                        + ["Industry: Other planner"]
-                        + ["Industry: Trust co."]
-
-                        )
-        for item in bigxml.Parser(f).iter_from(Entry):
-            if "Y" in item.advisory:
-                writer.writerow([str(item.name)]
-                                + [str(item.notices)]
-                                + [str(item.org_type)]
-                                + [str(item.offices)]
-                                + [str(item.employees)]
-                                + [str(item.state)]
-                                + [str(item.city)]
-                                + [str(item.clients_indiv_count)]
-                                + [str(item.clients_indiv_aum)]
-                                + [str(item.clients_hnw_count)]
-                                + [str(item.clients_hnw_aum)]
-                                + [str(item.clients_charitable_count)]
-                                + [str(item.clients_charitable_aum)]
-                                + [str(item.clients_corp_count)]
-                                + [str(item.clients_corp_aum)]
-                                + [str(item.advisory)]
-                                + [str(item.compensation_percentage)]
-                                + [str(item.compensation_hourly)]
-                                + [str(item.compensation_subscription)]
-                                + [str(item.compensation_fixed)]
-                                + [str(item.compensation_commission)]
-                                + [str(item.compensation_performance)]
-                                + [str(item.compensation_other)]
-                                + [str(item.aum_disc_accounts)]
-                                + [str(item.aum_disc_dollars)]
-                                + [str(item.aum_nondisc_accounts)]
-                                + [str(item.aum_nondisc_dollars)]
-                                + [str(item.aum_total_accounts)]
-                                + [str(item.aum_total_dollars)]
-                                + [str(item.has_trust_co)]
-                                + [str(item.industry_brokerdealer)]
-                                + [str(item.industry_planner)]
-                                + [str(item.industry_trust)]
-                                )
+# (element path below <Firm>, attribute, Entry field) for the table engine;
+# mirrors Entry's handlers above
+TABLE = [
+    (("Info",), "BusNm", "name"),
+    (("Info",), "FirmCrdNb", "crd"),
+    (("Info",), "SECNb", "sec_number"),
+    (("MainAddr",), "City", "city"),
+    (("MainAddr",), "State", "state"),
+    (("NoticeFiled", "States"), "RgltrCd", "notices"),
+    (("FormInfo", "Part1A", "Item1"), "Q1F5", "offices"),
+    (("FormInfo", "Part1A", "Item3A"), "OrgFormNm", "org_type"),
+    (("FormInfo", "Part1A", "Item5A"), "TtlEmp", "employees"),
+    (("FormInfo", "Part1A", "Item5D"), "Q5DA1", "clients_indiv_count"),
+    (("FormInfo", "Part1A", "Item5D"), "Q5DA3", "clients_indiv_aum"),
+    (("FormInfo", "Part1A", "Item5D"), "Q5DB1", "clients_hnw_count"),
+    (("FormInfo", "Part1A", "Item5D"), "Q5DB3", "clients_hnw_aum"),
+    (("FormInfo", "Part1A", "Item5D"), "Q5DF1", "clients_pools_count"),
+    (("FormInfo", "Part1A", "Item5D"), "Q5DF3", "clients_pools_aum"),
+    (("FormInfo", "Part1A", "Item5D"), "Q5DH1", "clients_charitable_count"),
+    (("FormInfo", "Part1A", "Item5D"), "Q5DH3", "clients_charitable_aum"),
+    (("FormInfo", "Part1A", "Item5D"), "Q5DM1", "clients_corp_count"),
+    (("FormInfo", "Part1A", "Item5D"), "Q5DM3", "clients_corp_aum"),
+    (("FormInfo", "Part1A", "Item5E"), "Q5E1", "compensation_percentage"),
+    (("FormInfo", "Part1A", "Item5E"), "Q5E2", "compensation_hourly"),
+    (("FormInfo", "Part1A", "Item5E"), "Q5E3", "compensation_subscription"),
+    (("FormInfo", "Part1A", "Item5E"), "Q5E4", "compensation_fixed"),
+    (("FormInfo", "Part1A", "Item5E"), "Q5E5", "compensation_commission"),
+    (("FormInfo", "Part1A", "Item5E"), "Q5E6", "compensation_performance"),
+    (("FormInfo", "Part1A", "Item5E"), "Q5E7", "compensation_other"),
+    (("FormInfo", "Part1A", "Item5F"), "Q5F2A", "aum_disc_dollars"),
+    (("FormInfo", "Part1A", "Item5F"), "Q5F2B", "aum_nondisc_dollars"),
+    (("FormInfo", "Part1A", "Item5F"), "Q5F2C", "aum_total_dollars"),
+    (("FormInfo", "Part1A", "Item5F"), "Q5F2D", "aum_disc_accounts"),
+    (("FormInfo", "Part1A", "Item5F"), "Q5F2E", "aum_nondisc_accounts"),
+    (("FormInfo", "Part1A", "Item5F"), "Q5F2F", "aum_total_accounts"),
+    (("FormInfo", "Part1A", "Item5G"), "Q5G1", "advisory"),
+    (("FormInfo", "Part1A", "Item6A"), "Q6A8", "has_trust_co"),
+    (("FormInfo", "Part1A", "Item7A"), "Q7A1", "industry_brokerdealer"),
+    (("FormInfo", "Part1A", "Item7A"), "Q7A2", "industry_planner"),
+    (("FormInfo", "Part1A", "Item7A"), "Q7A9", "industry_trust"),
+]
+
+# Fields which collect a comma-terminated list instead of a single value
+APPEND_FIELDS = {"notices"}
+
+
+class Record:
+    """ Firm fields filled from TABLE, same attributes and defaults as Entry """
+    __slots__ = tuple(f.name for f in dataclasses.fields(Entry))
+    defaults = tuple((f.name, f.default) for f in dataclasses.fields(Entry))
+
+    def __init__(self):
+        for field, default in self.defaults:
+            setattr(self, field, default)
+
+
+@dataclasses.dataclass
+class Filter:
+    """ Firm selection, tested per Entry field """
+    advisory: str = "Y"
+    states: set = None
+    org_types: set = None
+    notices: set = None
+    min_aum: int = None
+    max_aum: int = None
+
+    def tests(self):
+        """ Return {field: test} of active filters on single-valued fields """
+        tests = {}
+        if self.advisory == "Y":
+            tests["advisory"] = lambda value: "Y" in value
+        elif self.advisory == "N":
+            tests["advisory"] = lambda value: "Y" not in value
+        if self.states:
+            tests["state"] = lambda value: value in self.states
+        if self.org_types:
+            tests["org_type"] = lambda value: value in self.org_types
+        if self.min_aum is not None or self.max_aum is not None:
+            tests["aum_total_dollars"] = self.aum_test
+        return tests
+
+    def aum_test(self, value):
+        try:
+            aum = int(value)
+        except ValueError:
+            return False
+        return ((self.min_aum is None or aum >= self.min_aum)
+                and (self.max_aum is None or aum <= self.max_aum))
+
+    def accept(self, item):
+        """ Return whether entry passes all filters """
+        if self.notices and not self.notices.intersection(
+                item.notices.split(",")):
+            return False
+        return all(test(getattr(item, field))
+                   for field, test in self.tests().items())
+
+
+# Column headers and the Entry fields written under them, in output order
+COLUMNS = [
+    ("Firm: Name", "name"),
+    ("Firm: Notices", "notices"),
+    ("Firm: Org type", "org_type"),
+    ("Firm: # Offices", "offices"),
+    ("Firm: # Employees", "employees"),
+    ("Firm: HQ State", "state"),
+    ("Firm: HQ City", "city"),
+    ("Clients: Indiv", "clients_indiv_count"),
+    ("Clients: Indiv AUM", "clients_indiv_aum"),
+    ("Clients: HNW", "clients_hnw_count"),
+    ("Clients: HNW AUM", "clients_hnw_aum"),
+    ("Clients: Charitable", "clients_charitable_count"),
+    ("Clients: Charitable AUM", "clients_charitable_aum"),
+    ("Clients: Corporate", "clients_corp_count"),
+    ("Clients: Corporate AUM", "clients_corp_aum"),
+    ("Financil planning?", "advisory"),
+    ("Comp: %", "compensation_percentage"),
+    ("Comp: Hourly", "compensation_hourly"),
+    ("Comp: Subscription", "compensation_subscription"),
+    ("Comp: Fixed", "compensation_fixed"),
+    ("Comp: Commission", "compensation_commission"),
+    ("Comp: Performance", "compensation_performance"),
+    ("Comp: Other", "compensation_other"),
+    ("AUM: Discretionary", "aum_disc_accounts"),
+    ("AUM: Discretionary AUM", "aum_disc_dollars"),
+    ("AUM: Non-discretionary", "aum_nondisc_accounts"),
+    ("AUM: Non-discretionary AUM", "aum_nondisc_dollars"),
+    ("AUM: Total", "aum_total_accounts"),
+    ("AUM: Total AUM", "aum_total_dollars"),
+    ("Industry: Has Trust Co.", "has_trust_co"),
+    ("Industry: Broker-dealer", "industry_brokerdealer"),
+    ("Industry: Other planner", "industry_planner"),
+    ("Industry: Trust co.", "industry_trust"),
+]
+
+
+class Meter:
+    """ Binary file wrapper counting bytes read """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.count += len(data)
+        return data
+
+    def readinto(self, buffer):
+        size = self.raw.readinto(buffer)
+        self.count += size or 0
+        return size
+
+    def position(self):
+        """ Return offset in file, or bytes read from pipe """
+        return self.raw.tell() if self.raw.seekable() else self.count
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+def compression(raw):
+    """ Return compression format of buffered binary file, or None """
+    magic = raw.peek(max(map(len, MAGIC.values())))
+    for name, prefix in MAGIC.items():
+        if magic.startswith(prefix):
+            return name
+    return None
+
+
+@contextlib.contextmanager
+def open_input(path):
+    """ Yield (XML stream, Meter, size) of plain/compressed file or stdin """
+    raw = sys.stdin.buffer if path == "-" else open(path, "rb")
+    try:
+        meter = Meter(raw)
+        stat = os.fstat(raw.fileno())
+        size = stat.st_size if os.path.stat.S_ISREG(stat.st_mode) else None
+        kind = compression(raw)
+        if kind == "gzip":
+            stream = gzip.GzipFile(fileobj=meter)
+        elif kind == "xz":
+            stream = lzma.LZMAFile(meter)
+        elif kind == "zip":
+            if not raw.seekable():
+                raise InputError(f"{path}: zip input must be a seekable file")
+            archive = zipfile.ZipFile(meter)
+            names = archive.namelist()
+            xml_names = [n for n in names if n.lower().endswith(".xml")]
+            stream = archive.open((xml_names or names)[0])
+        else:
+            stream = meter
+        yield stream, meter, size
+    finally:
+        if raw is not sys.stdin.buffer:
+            raw.close()
+
+
+def is_plain_file(path):
+    """ Return whether path is an uncompressed file (needed by --workers) """
+    if path == "-":
+        return False
+    with open(path, "rb") as raw:
+        return compression(raw) is None
+
+
+class Progress:
+    """ Print bytes read, firms/sec and ETA to stderr every interval """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.position = lambda: 0
+        self.size = None
+        self.started = time.monotonic()
+        self.next = self.started + interval
+
+    def watch(self, position, size):
+        """ Follow bytes read via position() out of size (None if unknown) """
+        self.position = position
+        self.size = size
+
+    def update(self, firms):
+        now = time.monotonic()
+        if now < self.next:
+            return
+        self.next = now + self.interval
+        elapsed = now - self.started
+        done = self.position()
+        line = (f"{done / 1e6:.1f}"
+                + (f"/{self.size / 1e6:.1f}" if self.size else "")
+                + f" MB, {firms} firms, {firms / elapsed:.0f} firms/s")
+        if self.size and done:
+            eta = elapsed * (self.size - done) / done
+            line += f", ETA {datetime.timedelta(seconds=round(eta))}"
+        print(line, file=sys.stderr)
+
+
+def shard(path, count):
+    """ Return XML prologue, epilogue and byte ranges split at <Firm> tags """
+    with open(path, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        first = FIRM_TAG.search(m)
+        end = m.rfind(FIRMS_END)
+        if first is None or end < first.start():
+            return m[:], b"", []
+        bounds = [first.start()]
+        step = (end - bounds[0]) // count
+        for i in range(1, count):
+            match = FIRM_TAG.search(m, max(bounds[-1] + 1, bounds[0] + i * step))
+            if match is None or match.start() >= end:
+                break
+            bounds.append(match.start())
+        bounds.append(end)
+        return m[:bounds[0]], m[end:], list(zip(bounds, bounds[1:]))
+
+
+def iter_bigxml(firm_filter, *streams):
+    """ Yield entries of XML streams using bigxml and Entry's handlers,
+        None for entries rejected by filter """
+    for item in bigxml.Parser(*streams).iter_from(Entry):
+        yield item if firm_filter.accept(item) else None
+
+
+def iter_table(firm_filter, *streams):
+    """ Yield records of XML streams (bytes or files) using expat and TABLE,
+        None for firms rejected by filter """
+    tests = firm_filter.tests()
+    handlers = {}
+    for path, attr, field in TABLE:
+        handlers.setdefault(FIRM_PATH + path, []).append(
+            (attr, field, field in APPEND_FIELDS, tests.get(field)))
+    path = []
+    record = None
+    rejected = False
+    records = []
+
+    def start(name, attrs):
+        nonlocal record, rejected
+        path.append(name)
+        if rejected:
+            return
+        if record is None:
+            if len(path) == len(FIRM_PATH) and tuple(path) == FIRM_PATH:
+                record = Record()
+            return
+        for attr, field, append, test in handlers.get(tuple(path), ()):
+            if attr in attrs:
+                if append:
+                    setattr(record, field,
+                            getattr(record, field) + attrs[attr] + ",")
+                else:
+                    setattr(record, field, attrs[attr])
+            if test is not None and not test(getattr(record, field)):
+                rejected = True
+                return
+
+    def end(name):
+        nonlocal record, rejected
+        if len(path) == len(FIRM_PATH) and (record is not None or rejected):
+            if rejected or not firm_filter.accept(record):
+                records.append(None)
+            else:
+                records.append(record)
+            record = None
+            rejected = False
+        path.pop()
+
+    def forbid_entities(*args):
+        raise ValueError("XML entity declarations are not allowed")
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.EntityDeclHandler = forbid_entities
+    for stream in streams:
+        if isinstance(stream, (bytes, bytearray, memoryview)):
+            parser.Parse(stream, False)
+            yield from records
+            records.clear()
+            continue
+        for data in iter(lambda: stream.read(CHUNK_SIZE), b""):
+            parser.Parse(data, False)
+            yield from records
+            records.clear()
+    parser.Parse(b"", True)
+    yield from records
+
+
+# Parsing engines selectable with --engine
+ENGINES = {
+    "bigxml": iter_bigxml,
+    "table": iter_table,
+}
+
+
+def parse_shard(engine, firm_filter, path, prologue, epilogue, start, end):
+    """ Return entries of one byte range, wrapped in the document's root """
+    with open(path, "rb") as f:
+        f.seek(start)
+        body = f.read(end - start)
+    return list(ENGINES[engine](firm_filter, prologue, body, epilogue))
+
+
+def iter_entries(path, workers=1, engine="bigxml", firm_filter=Filter(),
+                 progress=None):
+    """ Yield entries of XML file in document order, None for firms
+        rejected by filter """
+    if workers <= 1:
+        with open_input(path) as (stream, meter, size):
+            if progress is not None:
+                progress.watch(meter.position, size)
+            yield from ENGINES[engine](firm_filter, stream)
+        return
+    prologue, epilogue, ranges = shard(path, workers * SHARDS_PER_WORKER)
+    if not ranges:
+        yield from ENGINES[engine](firm_filter, prologue)
+        return
+    done = len(prologue)
+    if progress is not None:
+        progress.watch(lambda: done, os.path.getsize(path))
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        results = pool.map(parse_shard,
+                           [engine] * len(ranges),
+                           [firm_filter] * len(ranges),
+                           [path] * len(ranges),
+                           [prologue] * len(ranges),
+                           [epilogue] * len(ranges),
+                           *zip(*ranges))
+        for (start, end), entries in zip(ranges, results):
+            done += end - start
+            yield from entries
+
+
+class SqliteSink:
+    """ Bulk-insert entries into typed, indexed SQLite tables """
+
+    # Entry fields stored as INTEGER
+    integer_fields = {
+        "offices", "employees",
+        "clients_indiv_count", "clients_indiv_aum",
+        "clients_hnw_count", "clients_hnw_aum",
+        "clients_pools_count", "clients_pools_aum",
+        "clients_charitable_count", "clients_charitable_aum",
+        "clients_corp_count", "clients_corp_aum",
+        "aum_disc_dollars", "aum_nondisc_dollars", "aum_total_dollars",
+        "aum_disc_accounts", "aum_nondisc_accounts", "aum_total_accounts",
+    }
+
+    def __init__(self, path):
+        self.fields = [f.name for f in dataclasses.fields(Entry)
+                       if f.name != "notices"]
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            "DROP TABLE IF EXISTS notices;"
+            "DROP TABLE IF EXISTS firms;"
+            "CREATE TABLE firms (id INTEGER PRIMARY KEY, "
+            + ", ".join(f"{field} "
+                        + ("INTEGER" if field in self.integer_fields
+                           else "TEXT")
+                        for field in self.fields) + ");"
+            "CREATE TABLE notices ("
+            "firm_id INTEGER NOT NULL REFERENCES firms(id), state TEXT);")
+        self.insert_firm = (
+            f"INSERT INTO firms (id, {', '.join(self.fields)}) "
+            f"VALUES (?{', ?' * len(self.fields)})")
+        self.count = 0
+        self.firms = []
+        self.notices = []
+
+    def value(self, item, field):
+        """ Return SQLite value of entry's field """
+        value = getattr(item, field)
+        if field not in self.integer_fields:
+            return value
+        try:
+            return int(value)
+        except ValueError:
+            return value if value not in ("", "n/a") else None
+
+    def add(self, item):
+        self.count += 1
+        firm_id = self.count
+        self.firms.append([firm_id] + [self.value(item, field)
+                                       for field in self.fields])
+        self.notices.extend((firm_id, state)
+                            for state in item.notices.split(",") if state)
+        if len(self.firms) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        with self.db:
+            self.db.executemany(self.insert_firm, self.firms)
+            self.db.executemany("INSERT INTO notices VALUES (?, ?)",
+                                self.notices)
+        self.firms.clear()
+        self.notices.clear()
+
+    def close(self):
+        self.flush()
+        with self.db:
+            self.db.executescript(
+                "CREATE INDEX firms_state ON firms (state);"
+                "CREATE INDEX firms_org_type ON firms (org_type);"
+                "CREATE INDEX firms_aum ON firms (aum_total_dollars);"
+                "CREATE INDEX notices_firm ON notices (firm_id);"
+                "CREATE INDEX notices_state ON notices (state);")
+        self.db.close()
+
+
+def firm_row(item):
+    """ Return CSV row of entry """
+    return [str(getattr(item, field)) for _, field in COLUMNS]
+
+
+def firm_key(item):
+    """ Return key identifying firm across feeds """
+    return item.crd or item.sec_number
+
+
+def row_hash(row):
+    """ Return hash of CSV row, to detect changed firms """
+    return hashlib.blake2b("\x1f".join(row).encode(), digest_size=16).hexdigest()
+
+
+def load_previous(path, workers=1, engine="bigxml", firm_filter=Filter()):
+    """ Return {key: (hash, row)} of previous XML feed or snapshot file """
+    with open_input(path) as (stream, _, _):
+        head = stream.read(64)
+    is_xml = head.lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"<")
+    previous = {}
+    if is_xml:
+        # Only an uncompressed file can be split between workers
+        if workers > 1 and not is_plain_file(path):
+            workers = 1
+        for item in iter_entries(path, workers, engine, firm_filter):
+            if item is not None:
+                row = firm_row(item)
+                previous[firm_key(item)] = (row_hash(row), row)
+    else:
+        with open(path, newline="") as f:
+            reader = csv.reader(f)
+            if next(reader, None) != SNAPSHOT_HEADER:
+                raise InputError(f"{path}: not an XML feed or --snapshot file")
+            for key, digest in reader:
+                previous[key] = (digest, None)
+    return previous
+
+
+def print_stats(scanned, written, started):
+    """ Print throughput and peak memory of run to stderr """
+    elapsed = time.monotonic() - started
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    print(f"{scanned} firms scanned, {written} written in {elapsed:.2f}s "
+          f"({scanned / elapsed if elapsed else 0:.0f} firms/s), "
+          f"peak RSS {rss / 1024:.1f} MB", file=sys.stderr)
+
+
+def main():
+    """ Parse arguments, extract entries, write CSV. """
+    parser = argparse.ArgumentParser(
+        description="Dump relevant IAPD XML data to CSV file")
+    parser.add_argument("input",
+                        help="IAPD 'SEC Investment Advisers' XML file "
+                             "(optionally .gz/.xz/.zip), or - for stdin.")
+    parser.add_argument("output",
+                        help="Output CSV file.")
+    parser.add_argument("-w",
+                        "--workers",
+                        default=1,
+                        help="Number of parsing processes (default: 1).",
+                        type=int)
+    parser.add_argument("-e",
+                        "--engine",
+                        choices=ENGINES,
+                        default="bigxml",
+                        help="XML extraction engine (default: bigxml).")
+    parser.add_argument("-f",
+                        "--format",
+                        choices=["csv", "sqlite"],
+                        default="csv",
+                        help="Output format (default: csv).")
+    parser.add_argument("-d",
+                        "--diff",
+                        dest="previous",
+                        help="Only write firms changed since this XML feed "
+                             "or snapshot file.")
+    parser.add_argument("-s",
+                        "--snapshot",
+                        help="Write CRD and row hash of each firm to this "
+                             "file, for a later --diff.")
+    parser.add_argument("--advisory",
+                        choices=["Y", "N", "any"],
+                        default="Y",
+                        help="Only firms with (Y) or without (N) financial "
+                             "planning services (default: Y).")
+    parser.add_argument("--state",
+                        dest="states",
+                        help="Only firms headquartered in these states.",
+                        action="append")
+    parser.add_argument("--org-type",
+                        dest="org_types",
+                        help="Only firms with these legal structures.",
+                        action="append")
+    parser.add_argument("--notice",
+                        dest="notices",
+                        help="Only firms with notice filings in any of "
+                             "these states.",
+                        action="append")
+    parser.add_argument("--min-aum",
+                        help="Only firms with at least this total AUM.",
+                        type=int)
+    parser.add_argument("--max-aum",
+                        help="Only firms with at most this total AUM.",
+                        type=int)
+    parser.add_argument("-p",
+                        "--progress",
+                        help="Print progress to stderr every N seconds.",
+                        metavar="N",
+                        type=float)
+    parser.add_argument("--stats",
+                        action="store_true",
+                        help="Print firms scanned/written, firms/sec and "
+                             "peak RSS to stderr.")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    if args.format == "sqlite" and args.previous:
+        parser.error("--diff writes CSV only")
+    if args.workers > 1 and not is_plain_file(args.input):
+        parser.error("--workers needs an uncompressed XML file")
+
+    firm_filter = Filter(advisory=args.advisory,
+                         states=set(args.states or ()),
+                         org_types=set(args.org_types or ()),
+                         notices=set(args.notices or ()),
+                         min_aum=args.min_aum,
+                         max_aum=args.max_aum)
+    try:
+        with metrics.measure("iapd", args) as run:
+            dump(args, firm_filter, run)
+    except InputError as e:
+        parser.error(str(e))
+
+
+def dump(args, firm_filter, run):
+    """ Write rows of firms passing filter, as args say """
+    started = time.monotonic()
+    progress = Progress(args.progress) if args.progress else None
+    previous = None
+    if args.previous:
+        with run.stage("load"):
+            previous = load_previous(args.previous, args.workers, args.engine,
+                                     firm_filter)
+    if is_plain_file(args.input):
+        run.count("bytes", os.path.getsize(args.input))
+    scanned = written = 0
+    with contextlib.ExitStack() as stack:
+        sink = writer = None
+        if args.format == "sqlite":
+            sink = stack.enter_context(
+                contextlib.closing(SqliteSink(args.output)))
+        else:
+            w = stack.enter_context(open(args.output, "w"))
+            writer = csv.writer(w, delimiter=",", quotechar='"',
+                                quoting=csv.QUOTE_ALL)
+            header = [header for header, _ in COLUMNS]
+            if previous is None:
+                writer.writerow(header)
+            else:
+                writer.writerow(["Change", "Firm: CRD"] + header)
+        snapshot = None
+        if args.snapshot:
+            s = stack.enter_context(open(args.snapshot, "w", newline=""))
+            snapshot = csv.writer(s, quoting=csv.QUOTE_ALL)
+            snapshot.writerow(SNAPSHOT_HEADER)
+        run.mark()
+        for item in iter_entries(args.input, args.workers, args.engine,
+                                 firm_filter, progress):
+            run.lap("parse")
+            scanned += 1
+            if progress is not None:
+                progress.update(scanned)
+            if item is None:
+                continue
+            row = firm_row(item)
+            if snapshot is not None or previous is not None:
+                key = firm_key(item)
+                digest = row_hash(row)
+            run.lap("extract")
+            if snapshot is not None:
+                snapshot.writerow([key, digest])
+            if sink is not None:
+                written += 1
+                sink.add(item)
+            elif previous is None:
+                written += 1
+                writer.writerow(row)
+            elif key not in previous:
+                written += 1
+                writer.writerow(["added", key] + row)
+            elif previous.pop(key)[0] != digest:
+                written += 1
+                writer.writerow(["changed", key] + row)
+            run.lap("write")
+        for key, (digest, row) in (previous or {}).items():
+            written += 1
+            writer.writerow(["removed", key] + (row or [""] * len(COLUMNS)))
+        run.lap("write")
+    run.lap("write")
+    run.count("firms_scanned", scanned)
+    run.count("firms_written", written)
+    if args.stats:
+        print_stats(scanned, written, started)
+
+
+if __name__ == "__main__":
+    main()
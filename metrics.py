@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+#
+# Per-run instrumentation shared by iapd.py, fweet.py, scrape-mises.py and
+# wikiquote.py, imported from the same directory. Each gets the options
+#
+#   --metrics-json FILE   append one JSON summary of the run to FILE (- for
+#                         stderr): script, arguments, start date, wall time,
+#                         seconds spent in each stage (fetch, parse, extract,
+#                         write, ...), counts (items, bytes, errors, ...),
+#                         peak RSS, and HTTP totals from fetch.py
+#   --profile cpu         run under cProfile (main thread and threads it
+#                         starts) and print the top functions to stderr
+#   --profile memory      run under tracemalloc and print the top allocating
+#                         lines and peak traced memory to stderr
+#
+# Stage times add up across threads, so with a pool of workers a stage can
+# take longer than the run. Worker processes (iapd.py --workers) aren't
+# profiled; their parsing shows as time waiting on them.
+#
+#   with metrics.measure("fweet", args) as run:
+#       with run.stage("fetch"):
+#           ...
+#       run.count("pages")
+#       run.attach("fetch", fetcher.metrics.summary)
+
+import contextlib
+import sys
+import threading
+import time
+
+# Functions/lines printed by --profile
+TOP = 25
+
+
+def add_arguments(parser):
+    """ Add --metrics-json and --profile to argparse parser """
+    parser.add_argument("--metrics-json",
+                        help="Append JSON summary of stage times and counts "
+                             "to this file, - for stderr.",
+                        metavar="FILE")
+    parser.add_argument("--profile",
+                        choices=["cpu", "memory"],
+                        help="Print cProfile or tracemalloc top entries to "
+                             "stderr.")
+
+
+class Run:
+    """ Stage times and counts of one run """
+
+    def __init__(self, script):
+        self.script = script
+        self.date = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.stages = {}
+        self.counts = {}
+        self.sources = {}
+        self.error = None
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """ Add time spent in with block to stage """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0) + seconds
+
+    def lap(self, name):
+        """ Add time since last lap to stage; for one thread's loop """
+        now = time.perf_counter()
+        self.stages[name] = self.stages.get(name, 0) + now - self.last
+        self.last = now
+
+    def mark(self):
+        """ Start timing next lap now """
+        self.last = time.perf_counter()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def attach(self, name, source):
+        """ Include source() in summary as name """
+        self.sources[name] = source
+
+    def summary(self, argv=None):
+        """ Return dict of run """
+        summary = {
+            "script": self.script,
+            "argv": sys.argv[1:] if argv is None else argv,
+            "date": self.date,
+            "seconds": round(time.perf_counter() - self.started, 3),
+            "stages": {name: round(seconds, 3)
+                       for name, seconds in self.stages.items()},
+            "counts": dict(self.counts),
+        }
+        try:
+            import resource
+        except ImportError:
+            resource = None
+        if resource:
+            peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                       resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+            # ru_maxrss is KB on Linux, bytes on macOS
+            summary["peak_rss_mb"] = round(
+                peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+        for name, source in self.sources.items():
+            summary[name] = source()
+        if self.error:
+            summary["error"] = self.error
+        return summary
+
+    def write(self, path):
+        """ Append summary as a JSON line to path, - for stderr """
+        import json
+
+        line = json.dumps(self.summary()) + "\n"
+        if path == "-":
+            sys.stderr.write(line)
+        else:
+            with open(path, "a") as f:
+                f.write(line)
+
+
+class Profiler:
+    """ cProfile of the calling thread and the threads started after it """
+
+    def __init__(self):
+        import cProfile
+
+        self.profiles = [cProfile.Profile()]
+
+    def hook(self, *args):
+        """ Profile a new thread; never let that fail the thread """
+        import cProfile
+
+        sys.setprofile(None)
+        try:
+            profile = cProfile.Profile()
+            profile.enable()
+        except Exception:
+            return
+        self.profiles.append(profile)
+
+    def start(self):
+        # From 3.12 a profile covers all threads, and a second one can't be
+        # enabled while it runs
+        if sys.version_info < (3, 12):
+            threading.setprofile(self.hook)
+        self.profiles[0].enable()
+
+    def stop(self, file=sys.stderr):
+        import pstats
+
+        threading.setprofile(None)
+        self.profiles[0].disable()
+        stats = pstats.Stats(*self.profiles, stream=file)
+        stats.sort_stats("cumulative").print_stats(TOP)
+
+
+def print_memory(file=sys.stderr):
+    """ Print top allocating lines and peak of tracemalloc """
+    import tracemalloc
+
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"tracemalloc: {current / 1e6:.1f} MB current, "
+          f"{peak / 1e6:.1f} MB peak", file=file)
+    for stat in snapshot.statistics("lineno")[:TOP]:
+        print(stat, file=file)
+
+
+@contextlib.contextmanager
+def measure(script, args):
+    """ Yield Run of script, profiled and summarized as args ask """
+    run = Run(script)
+    profiler = None
+    if args.profile == "cpu":
+        profiler = Profiler()
+        profiler.start()
+    elif args.profile == "memory":
+        import tracemalloc
+
+        tracemalloc.start()
+    try:
+        yield run
+    except BaseException as e:
+        if not isinstance(e, SystemExit) or e.code:
+            run.count("errors")
+            run.error = repr(e)
+        raise
+    finally:
+        if profiler:
+            profiler.stop()
+        elif args.profile == "memory":
+            print_memory()
+        if args.metrics_json:
+            run.write(args.metrics_json)
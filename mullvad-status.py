@@ -4,16 +4,160 @@
 #
 # If connected, outputs "City, State" of relay node
 # If not connected, outputs "OFF"
+#
+# With --watch, stays running on one `mullvad status listen` subscription and
+# writes each status change to a cache file (with the watcher's pid), in
+# $XDG_RUNTIME_DIR or else a private directory of the user's in the temp
+# directory. If listen ends or isn't supported, polls `mullvad status`
+# instead, backing off from --interval to a minute while it fails. A plain
+# invocation prints the cached status if the watcher is alive, else runs
+# `mullvad status` itself, so status bars can call it every second for the
+# price of a file read.
+#
+# Usage:
+#   $ mullvad-status.py --watch &
+#   $ mullvad-status.py
 
-import subprocess
+import argparse
+import os
+import signal
+import stat
 import sys
+import tempfile
+import time
+
+# Cache of "<watcher pid>\n<status>\n", in the runtime directory or else a
+# directory only we can use
+runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+cache_dir = runtime_dir or os.path.join(tempfile.gettempdir(),
+                                        f"mullvad-status-{os.getuid()}")
+cache_file = os.path.join(cache_dir, f"mullvad-status-{os.getuid()}")
+
+# Longest wait between polls when mullvad fails
+max_interval = 60
+
+
+def parse(state):
+    """ Return "City, State" of `mullvad status` output, or "OFF" """
+    status = "OFF"
+    if state.split() and state.split()[0] == "Connected":
+        status = " ".join(state.split()[-2:])
+    return status
+
+
+def query():
+    import subprocess
+    return parse(subprocess.check_output(["mullvad", "status"]).decode().strip())
+
+
+def read_cache(path):
+    """ Return cached status if its watcher is alive, else None """
+    try:
+        with open(path) as f:
+            pid, status = f.read().split("\n")[:2]
+        pid = int(pid)
+    except (OSError, ValueError):
+        return None
+    try:
+        os.kill(pid, 0)
+    except PermissionError:
+        # Alive, but not ours to signal
+        pass
+    except OSError:
+        return None
+    return status
+
+
+def write_cache(path, status):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(f"{os.getpid()}\n{status}\n")
+    os.replace(tmp, path)
+
+
+def make_private_dir(path):
+    """ Create directory only we can use; refuse one someone else made """
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        st = os.lstat(path)
+        if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid()
+                or st.st_mode & 0o077):
+            sys.exit(f"{path}: not a private directory")
+
+
+def listen(path):
+    """ Cache statuses from `mullvad status listen` until it ends """
+    import subprocess
+    block = []
+    with subprocess.Popen(["mullvad", "status", "listen"],
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL,
+                          text=True) as proc:
+        try:
+            # Each unindented line starts a new status, detail lines follow it
+            for line in proc.stdout:
+                if not line.strip():
+                    continue
+                if not line[0].isspace():
+                    block = []
+                block.append(line)
+                write_cache(path, parse("".join(block)))
+        finally:
+            # Popen's exit waits for listen, which only ends when told to
+            proc.terminate()
+            proc.wait()
+
+
+def watch(path, interval):
+    """ Keep cache up to date until terminated """
+    import subprocess
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit())
+    delay = interval
+    try:
+        while True:
+            try:
+                listen(path)
+                write_cache(path, query())
+                delay = interval
+            except (OSError, subprocess.CalledProcessError):
+                delay = min(delay * 2, max_interval)
+            time.sleep(delay)
+    finally:
+        try:
+            with open(path) as f:
+                mine = f.readline().strip() == str(os.getpid())
+            if mine:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print Mullvad VPN status")
+    parser.add_argument("-w",
+                        "--watch",
+                        action="store_true",
+                        help="Keep cache file of status up to date.")
+    parser.add_argument("-i",
+                        "--interval",
+                        default=5,
+                        help="Seconds between polls when listen is "
+                             "unavailable (default: 5).",
+                        type=float)
+    parser.add_argument("--cache",
+                        default=cache_file,
+                        help=f"Cache file (default: {cache_file}).")
+    args = parser.parse_args()
 
-state = subprocess.check_output(
-                    "mullvad status", shell=True
-                    ).decode().strip()
-status = "OFF"
+    if args.watch:
+        if args.cache == cache_file and not runtime_dir:
+            make_private_dir(cache_dir)
+        watch(args.cache, args.interval)
+        return
+    status = read_cache(args.cache)
+    print(status if status is not None else query())
 
-if str(state).split()[0] == "Connected":
-    status = " ".join(state.split()[-2:])
 
-print(status)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#
+# Output random sequential line(s) from input text file
+#
+# Arg 1: path to text file
+# Arg 2: number of sequential lines to output
+#
+# Same choice of lines as multi-line.sh: the window starts at a random line
+# from 1 to (lines - N), and a single empty line is drawn again. Instead of
+# scanning the file on every run, the offset of each line is kept in an index
+# under $XDG_CACHE_HOME/multi-line (rebuilt when the file's size or mtime
+# changes), and both files are memory-mapped, so a window is found and read
+# in constant time however big the file. --samples draws several windows per
+# run, separated by "--" when N > 1.
+#
+# $ multi-line.py /path/to/file.txt 10
+# $ multi-line.py --samples 5 finneganswake.txt 1
+
+import argparse
+import array
+import hashlib
+import itertools
+import mmap
+import os
+import random
+import struct
+import sys
+
+cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME")
+                         or os.path.expanduser("~/.cache"), "multi-line")
+
+# Index header: magic, file mtime_ns, file size, number of offsets; followed by
+# 8-byte offsets of the start of each line, and of the end of the file
+HEADER = struct.Struct("<4s4xqqQ")
+MAGIC = b"MLI1"
+
+# Draws of an empty line before giving up on a non-empty one
+max_retries = 1000
+
+
+def index_path(path):
+    """ Return cache path of line index of file """
+    key = hashlib.sha1(os.path.realpath(path).encode()).hexdigest()
+    return os.path.join(cache_dir, key + ".idx")
+
+
+def build_index(path, idx, stat):
+    """ Write line offsets of file to index """
+    with open(path, "rb") as f:
+        offsets = array.array("Q", itertools.accumulate(map(len, f), initial=0))
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    os.makedirs(os.path.dirname(idx), exist_ok=True)
+    with open(idx + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, stat.st_mtime_ns, stat.st_size, len(offsets)))
+        offsets.tofile(f)
+    os.replace(idx + ".tmp", idx)
+
+
+def open_index(path):
+    """ Return memoryview of line offsets of file, (re)building index """
+    stat = os.stat(path)
+    idx = index_path(path)
+    for _ in range(2):
+        try:
+            with open(idx, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, mtime_ns, size, count = HEADER.unpack_from(mm)
+            if (magic == MAGIC and mtime_ns == stat.st_mtime_ns
+                    and size == stat.st_size
+                    and len(mm) == HEADER.size + 8 * count):
+                offsets = memoryview(mm)[HEADER.size:].cast("Q")
+                return offsets if sys.byteorder == "little" else offsets.tolist()
+        except (OSError, ValueError, struct.error):
+            pass
+        build_index(path, idx, stat)
+    sys.exit(f"{idx}: can't read index")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Output random sequential lines from text file")
+    parser.add_argument("file",
+                        help="Path to text file.")
+    parser.add_argument("number",
+                        help="Number of sequential lines to output.",
+                        type=int)
+    parser.add_argument("-s",
+                        "--samples",
+                        default=1,
+                        help="Number of windows to output (default: 1).",
+                        type=int)
+    args = parser.parse_args()
+
+    offsets = open_index(args.file)
+    # Lines as counted by wc -l, i.e. without an unterminated last line
+    lines = len(offsets) - 1
+    size = offsets[lines]
+    with open(args.file, "rb") as f:
+        text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+    if lines and text[size - 1:size] != b"\n":
+        lines -= 1
+    if lines - args.number < 1:
+        sys.exit(f"{args.file}: fewer than {args.number + 1} lines")
+    out = sys.stdout.buffer
+    for sample in range(args.samples):
+        for _ in range(max_retries if args.number == 1 else 1):
+            start = random.randint(1, lines - args.number)
+            output = text[offsets[start - 1]:offsets[start - 1 + args.number]]
+            if output.strip(b"\n"):
+                break
+        if sample and args.number > 1:
+            out.write(b"--\n")
+        out.write(output)
+
+
+if __name__ == "__main__":
+    main()
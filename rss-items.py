@@ -2,39 +2,230 @@
 #
 # Gets item titles from RSS feed and saves to file
 #
+# With --feeds, polls every feed listed in a file concurrently instead of the
+# one --input feed. Each line of the feeds file is
+#   URL OUTPUT [NUMBER [INTERVAL]]
+# with NUMBER defaulting to --number and INTERVAL (seconds between polls) to
+# --interval; blank lines and lines starting with # are ignored. Feeds are
+# fetched through fetch.py, which keeps each one in its HTTP --cache and
+# sends its ETag/Last-Modified back on the next poll, so an unchanged feed
+# costs a 304. Titles are then taken from the cached feed, and an output file
+# is only rewritten if they differ from it (or it's missing), e.g. after a
+# change of NUMBER, or a new line for a feed another output already uses.
+# Polls once and exits, or with --daemon keeps polling each feed on its own
+# interval, reporting request totals each time every feed has been polled.
+#
+# With --append, only items not seen before are appended to the output, oldest
+# first, instead of rewriting it. Items are keyed by id (or link) in a
+# "<output>.seen" JSON file holding the most recently seen --seen-max keys,
+# evicting the least recently seen, so it stays the same size however long
+# the feed is tracked.
+#
+# Usage:
+#   $ rss-items.py -i https://example.com/feed.xml -n 10 -o ~/titles.txt
+#   $ rss-items.py --feeds ~/feeds.txt
+#   $ rss-items.py --feeds ~/feeds.txt --daemon --workers 8
+#   $ rss-items.py --feeds ~/feeds.txt --append
 
 import argparse
+import collections
+import concurrent.futures
 import feedparser
+import json
 import os
+import time
+
+import fetch
+
+cache_dir = fetch.cache_home("rss-items")
+
+
+def read_feeds(path, number, interval):
+    """ Return [(url, output, number, interval)] of feeds file """
+    feeds = []
+    with open(os.path.expanduser(path)) as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            url, output, *rest = fields
+            feeds.append((url, os.path.expanduser(output),
+                          int(rest[0]) if rest else number,
+                          float(rest[1]) if len(rest) > 1 else interval))
+    return feeds
+
+
+def write_titles(xml, number, outfile):
+    """ Write titles of newest number items; return how many, or None if
+        the file already holds them """
+    entries = xml.entries[:number]
+    text = "".join(entry.title + "\n" for entry in entries)
+    try:
+        with open(outfile) as f:
+            if f.read() == text:
+                return None
+    except FileNotFoundError:
+        pass
+    with open(outfile, mode="w") as f:
+        f.write(text)
+    return len(entries)
+
+
+def append_titles(xml, number, outfile, seen_max):
+    """ Append titles of unseen items among newest number; return how many """
+    seen_file = outfile + ".seen"
+    try:
+        # A deleted output starts over from the current items
+        if not os.path.exists(outfile):
+            raise FileNotFoundError(outfile)
+        with open(seen_file) as f:
+            seen = collections.OrderedDict.fromkeys(json.load(f))
+    except (FileNotFoundError, ValueError):
+        seen = collections.OrderedDict()
+    new = []
+    for entry in reversed(xml.entries[:number]):
+        key = entry.get("id") or entry.get("link") or entry.title
+        if key in seen:
+            seen.move_to_end(key)
+        else:
+            seen[key] = None
+            new.append(entry)
+    # Never evict keys of items still in the feed window
+    while len(seen) > max(seen_max, number):
+        seen.popitem(last=False)
+    with open(outfile, mode="a") as f:
+        for entry in new:
+            f.write(entry.title + "\n")
+    with open(seen_file + ".tmp", "w") as f:
+        json.dump(list(seen), f)
+    os.replace(seen_file + ".tmp", seen_file)
+    return len(new)
+
+
+def parse_feed(fetcher, url):
+    """ Return (feedparser result, how response was cached) of feed at url,
+        which may also be a local file """
+    if not url.startswith(("http://", "https://")):
+        return feedparser.parse(os.path.expanduser(url)), None
+    r = fetcher.get(url)
+    r.raise_for_status()
+    return feedparser.parse(r.content, response_headers=r.headers), r.from_cache
+
+
+def poll(fetcher, url, output, number, seen_max=None):
+    """ Fetch feed conditionally, write titles if output changes """
+    xml, from_cache = parse_feed(fetcher, url)
+    if seen_max:
+        count = append_titles(xml, number, output, seen_max)
+        if from_cache and not count:
+            print(f"{url}: not modified")
+        else:
+            print(f"{url}: {count} new titles to {output}")
+    else:
+        count = write_titles(xml, number, output)
+        if count is None:
+            print(f"{url}: not modified")
+        else:
+            print(f"{url}: {count} titles to {output}")
+
+
+def poll_feeds(feeds, fetcher, workers, daemon, seen_max=None):
+    """ Poll feeds concurrently, once or each on its interval forever """
+    due = {feed: 0 for feed in feeds}
+    unpolled = set(feeds)
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        while True:
+            now = time.monotonic()
+            futures = {pool.submit(poll, fetcher, *feed[:3], seen_max):
+                       feed for feed in feeds if due[feed] <= now}
+            for future in concurrent.futures.as_completed(futures):
+                feed = futures[future]
+                due[feed] = time.monotonic() + feed[3]
+                unpolled.discard(feed)
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"{feed[0]}: failed: {e}")
+            if not unpolled:
+                # Report once every feed has been polled, and start over, so
+                # a daemon doesn't keep a record of every request it made
+                fetcher.metrics.report()
+                fetcher.metrics.reset()
+                unpolled = set(feeds)
+            if not daemon:
+                return
+            time.sleep(max(0, min(due.values()) - time.monotonic()))
+
+
+def main():
+    # Arguments
+    parser = argparse.ArgumentParser(description="Save RSS item titles to file")
+    parser.add_argument("-i",
+                        "--input",
+                        dest="url",
+                        help="URL of RSS/XML feed to parse.",
+                        type=str)
+    parser.add_argument("-n",
+                        "--number",
+                        default=10,
+                        dest="max",
+                        help="Maximum number of item titles to write to file.",
+                        type=int)
+    parser.add_argument("-o",
+                        "--output",
+                        dest="outfile",
+                        help="Output file in which to write item titles.",
+                        type=str)
+    parser.add_argument("-f",
+                        "--feeds",
+                        help="File of feeds to poll concurrently, one "
+                             "'URL OUTPUT [NUMBER [INTERVAL]]' per line.",
+                        type=str)
+    parser.add_argument("-c",
+                        "--cache",
+                        default=cache_dir,
+                        help=f"HTTP cache of feeds (default: {cache_dir}).",
+                        type=str)
+    parser.add_argument("-w",
+                        "--workers",
+                        default=4,
+                        help="Concurrent feed requests (default: 4).",
+                        type=int)
+    parser.add_argument("-d",
+                        "--daemon",
+                        action="store_true",
+                        help="Keep polling feeds instead of exiting.")
+    parser.add_argument("--interval",
+                        default=3600,
+                        help="Seconds between polls of a feed (default: 3600).",
+                        type=float)
+    parser.add_argument("-a",
+                        "--append",
+                        action="store_true",
+                        help="Append only titles of items not seen before.")
+    parser.add_argument("--seen-max",
+                        default=1000,
+                        help="Item keys remembered per output with --append "
+                             "(default: 1000).",
+                        type=int)
+    args = parser.parse_args()
+    seen_max = args.seen_max if args.append else None
+
+    if args.feeds:
+        feeds = read_feeds(args.feeds, args.max, args.interval)
+        fetcher = fetch.Fetcher(concurrency=args.workers,
+                                cache_dir=os.path.expanduser(args.cache))
+        poll_feeds(feeds, fetcher, args.workers, args.daemon, seen_max)
+        return
+    if not args.url or not args.outfile:
+        parser.error("-i/--input and -o/--output are required without --feeds")
+
+    xml, _ = parse_feed(fetch.Fetcher(), args.url)
+    if seen_max:
+        append_titles(xml, args.max, os.path.expanduser(args.outfile), seen_max)
+    else:
+        write_titles(xml, args.max, os.path.expanduser(args.outfile))
 
-# Arguments
-parser = argparse.ArgumentParser(description="Save RSS item titles to file")
-parser.add_argument("-i",
-                    "--input",
-                    dest="url",
-                    help="URL of RSS/XML feed to parse.",
-                    required=True,
-                    type=str)
-parser.add_argument("-n",
-                    "--number",
-                    default=10,
-                    dest="max",
-                    help="Maximum number of item titles to write to file.",
-                    required=True,
-                    type=int)
-parser.add_argument("-o",
-                    "--output",
-                    dest="outfile",
-                    help="Output file in which to write item titles.",
-                    required=True,
-                    type=str)
-args = parser.parse_args()
-
-xml = feedparser.parse(args.url)
-num_items = min(args.max, len(xml.entries))
-file = os.path.expanduser(args.outfile)
-
-with open(file, mode="w") as f:
-    for i in range(1, num_items + 1):
-        f.write(xml.entries[i].title + "\n")
 
+if __name__ == "__main__":
+    main()
@@ -2,58 +2,459 @@
 #
 # Downloads PDFs from the mises.org book library
 #
+# Listing pages are fetched by --listing-workers threads, page after page
+# until one has no results (the end of the library, so no page count to keep
+# up to date). Their entries go into a bounded queue that the download
+# workers consume, so listing and downloading overlap.
+#
+# Requests go through fetch.py (keep-alive sessions, retries with backoff,
+# per-host concurrency), and listing pages through its HTTP cache in
+# --cache, so a listing page that hasn't changed costs a 304. Request
+# metrics are printed at the end. --metrics-json appends a summary of time
+# spent fetching, parsing and extracting listing pages and downloading PDFs
+# to a file; --profile runs under cProfile or tracemalloc (see metrics.py).
+#
+# PDFs are downloaded by a pool of --workers threads and streamed to disk in
+# chunks as "<name>.pdf.part", renamed to "<name>.pdf" once complete. An
+# interrupted download resumes from the size of its .part file via an HTTP
+# Range request, with If-Range set to the ETag (or Last-Modified) the catalog
+# kept from the response that started it, so a file that changed meanwhile
+# comes back whole; it restarts if the server sends it whole, or if there's
+# no such validator to check the .part against. Aggregate throughput
+# is printed at the end. --base-url points the crawl at another host, e.g. a
+# local stand-in for testing, like the one tests/test_scrape_mises.py runs.
+#
+# Each download is recorded in a SQLite --catalog: source URL, file name,
+# ETag/Last-Modified, size and SHA-256. On a rerun, a cataloged file whose
+# size still matches (and hash too, with --verify) is revalidated with a
+# conditional GET and skipped on 304 Not Modified; a truncated one is fetched
+# again. If the listing renames an entry, the file is renamed rather than
+# downloaded again. Files from before the catalog are kept if a HEAD request
+# agrees on their size. A PDF whose hash matches one already cataloged under
+# another title is hardlinked to it instead of stored twice.
+#
+# --save-html keeps each listing page in a directory, so that after a change
+# to the extraction, --from-html can list entries from the saved pages instead
+# of fetching them again: they're parsed with lxml and XPath (no BeautifulSoup
+# tree) in a pool of --listing-workers processes. --list prints entries
+# (title, author, date, PDF URL) instead of downloading them.
+#
+#   $ scrape-mises.py --save-html pages/
+#   $ scrape-mises.py --from-html pages/ --list
+#
 
 from bs4 import BeautifulSoup
+import argparse
+import concurrent.futures
 import datetime
+import hashlib
 import os.path
+import queue
 import re
-import requests
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
 
-# Number of pages for [pdf] on Mises Book archive.
-## Test the following URL with &page=57, etc. then update the variable below
-## when you've identified the last pagination number.
-## https://mises.org/library/books?book_type=539&page=56
-pagination = 56
+import fetch
+import metrics
+
+# First page of [pdf] on Mises Book archive; pages are numbered from 0 and
+# fetched until one comes back empty.
+## https://mises.org/library/books?book_type=539&page=0
+first_page = 0
 
 # Base URL to parse.
 ## book_type=539 is for PDF
-url = "https://mises.org/library/books?book_type=539"
+base_url = "https://mises.org"
+path = "/library/books?book_type=539"
+
+# Bytes written per chunk of a download
+chunk_size = 1 << 16
+
+# Catalog of downloaded PDFs
+catalog_file = "mises.db"
+
+# HTTP cache of listing pages
+cache_dir = fetch.cache_home("scrape-mises")
+
+class Throughput:
+  """ Totals of bytes and files downloaded across threads """
+  def __init__(self):
+    self.started = time.monotonic()
+    self.bytes = 0
+    self.files = 0
+    self.lock = threading.Lock()
+
+  def add(self, size, files=0):
+    with self.lock:
+      self.bytes += size
+      self.files += files
+
+  def report(self):
+    elapsed = time.monotonic() - self.started
+    print("Downloaded %d files, %.1f MB in %.1fs (%.2f MB/s)" % (
+      self.files, self.bytes / 1e6, elapsed,
+      self.bytes / 1e6 / elapsed if elapsed else 0))
+
+throughput = Throughput()
+
+class FileLocks:
+  """ One lock per file name, so two entries never write the same file """
+  def __init__(self):
+    self.locks = {}
+    self.lock = threading.Lock()
+
+  def get(self, filename):
+    with self.lock:
+      return self.locks.setdefault(filename, threading.Lock())
+
+file_locks = FileLocks()
+
+class Catalog:
+  """ SQLite record of downloaded PDFs keyed by source URL, shared by threads """
+  def __init__(self, path):
+    self.db = sqlite3.connect(path, check_same_thread=False)
+    self.db.row_factory = sqlite3.Row
+    self.lock = threading.Lock()
+    with self.lock, self.db:
+      self.db.execute("""CREATE TABLE IF NOT EXISTS pdfs (
+        url TEXT PRIMARY KEY, filename TEXT NOT NULL, etag TEXT,
+        last_modified TEXT, size INTEGER NOT NULL, sha256 TEXT NOT NULL)""")
+      self.db.execute("CREATE INDEX IF NOT EXISTS pdfs_sha256 ON pdfs (sha256)")
+      ## Validators of the response each unfinished .part was written from
+      self.db.execute("""CREATE TABLE IF NOT EXISTS parts (
+        url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT)""")
+
+  def get(self, url):
+    with self.lock:
+      return self.db.execute("SELECT * FROM pdfs WHERE url = ?",
+                             (url,)).fetchone()
+
+  def find(self, sha256, url):
+    """ Return file name of another URL with the same content, or None """
+    with self.lock:
+      row = self.db.execute("SELECT filename FROM pdfs WHERE sha256 = ? AND url != ?",
+                            (sha256, url)).fetchone()
+    return row and row["filename"]
+
+  def put(self, url, filename, etag, last_modified, size, sha256):
+    with self.lock, self.db:
+      self.db.execute("INSERT OR REPLACE INTO pdfs VALUES (?, ?, ?, ?, ?, ?)",
+                      (url, filename, etag, last_modified, size, sha256))
+      self.db.execute("DELETE FROM parts WHERE url = ?", (url,))
+
+  def get_part(self, url):
+    with self.lock:
+      return self.db.execute("SELECT * FROM parts WHERE url = ?",
+                             (url,)).fetchone()
+
+  def put_part(self, url, etag, last_modified):
+    with self.lock, self.db:
+      self.db.execute("INSERT OR REPLACE INTO parts VALUES (?, ?, ?)",
+                      (url, etag, last_modified))
+
+  def rename(self, url, filename):
+    with self.lock, self.db:
+      self.db.execute("UPDATE pdfs SET filename = ? WHERE url = ?",
+                      (filename, url))
+
+  def close(self):
+    self.db.close()
 
 def sanitize(text):
   text = re.sub(r"[^a-zA-Z0-9]+", "", text.title())
   return text
 
-def scrape_page(soup):
+def scrape_page(soup, page_url):
   #print("Scraping page...")
-  for entry in soup.find_all("div", {"class": re.compile("^result-*")}):
-    scrape_entry(entry)
+  return [scrape_entry(entry, page_url)
+          for entry in soup.find_all("div", {"class": re.compile("^result-*")})]
 
-def scrape_entry(entry):
+def scrape_entry(entry, page_url):
   #print("Scraping entry...")
   title = [t.get_text() for t in entry.find_all("h2", {"class": "teaser-title"})]
   author = [u.get_text() for u in entry.find_all("span", {"class": "author"})]
   date = [d.get_text() for d in entry.find_all("span", {"class": "date"})]
   pdf = [a["href"] for a in entry.find_all("a", {"type": re.compile("^application/pdf*")})]
 
-  title = sanitize(title[0])
-  author = sanitize(author[0])
-  date = datetime.datetime.strptime(date[0], "%m/%d/%Y").strftime("%Y-%m-%d")
-  pdf = pdf[0]
+  return clean_entry(title[0], author[0], date[0], pdf[0], page_url)
+
+def clean_entry(title, author, date, pdf, page_url):
+  """ Return (title, author, date, pdf URL) of an entry's texts """
+  title = sanitize(title)
+  author = sanitize(author)
+  date = datetime.datetime.strptime(date, "%m/%d/%Y").strftime("%Y-%m-%d")
+  pdf = urllib.parse.urljoin(page_url, pdf)
+
+  return title, author, date, pdf
+
+def has_class(name, prefix=False):
+  """ Return XPath test of a class token equal to (or starting with) name """
+  return "contains(concat(' ', normalize-space(@class), ' '), ' %s%s')" % (
+    name, "" if prefix else " ")
+
+## Same elements as scrape_page and scrape_entry select
+result_xpath = "//div[%s]" % has_class("result", prefix=True)
+title_xpath = ".//h2[%s]" % has_class("teaser-title")
+author_xpath = ".//span[%s]" % has_class("author")
+date_xpath = ".//span[%s]" % has_class("date")
+pdf_xpath = ".//a[starts-with(@type, 'application/pd')]/@href"
+
+def extract_file(filename, page_url):
+  """ Return entries of listing page saved in file, via lxml """
+  import lxml.html
+
+  with open(filename, "rb") as f:
+    doc = lxml.html.document_fromstring(f.read())
+  found = []
+  for entry in doc.xpath(result_xpath):
+    found.append(clean_entry(entry.xpath(title_xpath)[0].text_content(),
+                             entry.xpath(author_xpath)[0].text_content(),
+                             entry.xpath(date_xpath)[0].text_content(),
+                             entry.xpath(pdf_xpath)[0], page_url))
+  return found
+
+def file_sha256(path, digest=None):
+  """ Return sha256 object of file contents, continuing digest if given """
+  digest = digest or hashlib.sha256()
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(chunk_size), b""):
+      digest.update(chunk)
+  return digest
+
+def intact(filename, known, verify=False):
+  """ Return whether file matches the size (and hash) catalog recorded """
+  try:
+    if os.path.getsize(filename) != known["size"]:
+      return False
+  except OSError:
+    return False
+  return not verify or file_sha256(filename).hexdigest() == known["sha256"]
 
-  download_entry(title, author, date, pdf)
+def pdf_filename(title, author, date):
+  return date + "_" + author + "_" + title + ".pdf"
 
-def download_entry(title, author, date, pdf):
-  filename =  date + "_" + author + "_" + title + ".pdf"
-  if os.path.isfile(filename):
-    print("Already downloaded " + filename)
+def if_range_validator(started):
+  """ Return If-Range value of a .part's validators, None if there's none """
+  etag = started["etag"]
+  if etag and not etag.startswith("W/"):
+    return etag
+  return started["last_modified"]
+
+def download_entry(title, author, date, pdf, catalog, fetcher, verify=False):
+  filename = pdf_filename(title, author, date)
+  known = catalog.get(pdf)
+  headers = {}
+  if known and intact(known["filename"], known, verify):
+    if known["filename"] != filename:
+      ## Listing metadata changed, content may not have
+      os.replace(known["filename"], filename)
+      print("Renamed %s to %s" % (known["filename"], filename))
+      catalog.rename(pdf, filename)
+    if known["etag"]:
+      headers["If-None-Match"] = known["etag"]
+    if known["last_modified"]:
+      headers["If-Modified-Since"] = known["last_modified"]
+    if not headers:
+      print("Already downloaded " + filename)
+      return
+  elif not known and os.path.isfile(filename):
+    ## Downloaded before the catalog: keep it if the server agrees on size
+    with fetcher.request("HEAD", pdf, allow_redirects=True) as head:
+      head.raise_for_status()
+      if head.headers.get("Content-Length") == str(os.path.getsize(filename)):
+        catalog.put(pdf, filename, head.headers.get("ETag"),
+                    head.headers.get("Last-Modified"),
+                    os.path.getsize(filename),
+                    file_sha256(filename).hexdigest())
+        print("Already downloaded " + filename)
+        return
+  elif known:
+    print("Incomplete " + known["filename"])
+  part = filename + ".part"
+  offset = os.path.getsize(part) if os.path.isfile(part) else 0
+  started = catalog.get_part(pdf) if offset else None
+  if_range = started and if_range_validator(started)
+  if if_range:
+    headers = {"Range": "bytes=%d-" % offset, "If-Range": if_range}
+  else:
+    ## Unknown which version of the file the .part holds
+    offset = 0
+  print(("Resuming " if offset else "Checking " if headers else "Downloading ") + filename)
+  with fetcher.get(pdf, headers=headers, stream=True) as dl:
+    if dl.status_code == 304:
+      print("Already downloaded " + filename)
+      return
+    if dl.status_code == 416:
+      ## Range starts at end of file: .part is complete if sizes match
+      total = dl.headers.get("Content-Range", "").rpartition("/")[2]
+      if total != str(offset):
+        os.remove(part)
+        return download_entry(title, author, date, pdf, catalog, fetcher, verify)
+      digest = file_sha256(part)
+      etag, last_modified = started["etag"], started["last_modified"]
+    else:
+      dl.raise_for_status()
+      etag = dl.headers.get("ETag")
+      last_modified = dl.headers.get("Last-Modified")
+      if dl.status_code != 206:
+        offset = 0
+        catalog.put_part(pdf, etag, last_modified)
+      digest = file_sha256(part) if offset else hashlib.sha256()
+      with open(part, "ab" if offset else "wb") as f:
+        for chunk in dl.iter_content(chunk_size=chunk_size):
+          f.write(chunk)
+          digest.update(chunk)
+          throughput.add(len(chunk))
+  size = os.path.getsize(part)
+  sha256 = digest.hexdigest()
+  same = catalog.find(sha256, pdf)
+  if same and same != filename and intact(same, {"size": size}):
+    ## Same PDF listed under another title: link instead of a second copy
+    os.remove(part)
+    if os.path.exists(filename):
+      os.remove(filename)
+    os.link(same, filename)
+    print("Linked %s to %s" % (filename, same))
   else:
-    print("Downloading " + filename)
-    dl = requests.get(pdf)
-    with open(filename, 'wb') as f:
-      f.write(dl.content)
-
-for p in range(1, 55):
-  req = requests.get(url + "&page=" + str(p))
-  soup = BeautifulSoup(req.content, "lxml")
-  print("Scraping page " + str(p))
-  scrape_page(soup)
+    os.replace(part, filename)
+  catalog.put(pdf, filename, etag, last_modified, size, sha256)
+  throughput.add(0, 1)
+
+def list_pages(base_url, workers, entries, fetcher, run, save_html=None):
+  """ Put entries of listing pages on queue until a page has none """
+  def fetch_page(p):
+    page_url = base_url + path + "&page=" + str(p)
+    with run.stage("fetch"):
+      req = fetcher.get(page_url)
+      req.raise_for_status()
+    if save_html:
+      with open(os.path.join(save_html, "%d.html" % p), "wb") as f:
+        f.write(req.content)
+    with run.stage("parse"):
+      soup = BeautifulSoup(req.content, "lxml")
+    print("Scraping page " + str(p))
+    with run.stage("extract"):
+      found = scrape_page(soup, page_url)
+    run.count("pages")
+    run.count("entries", len(found))
+    return found
+
+  with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+    next_page = first_page
+    end = None
+    pending = {}
+    while pending or end is None:
+      while end is None and len(pending) < workers:
+        pending[pool.submit(fetch_page, next_page)] = next_page
+        next_page += 1
+      done, _ = concurrent.futures.wait(
+        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        p = pending.pop(future)
+        found = future.result()
+        if not found:
+          end = p if end is None else min(end, p)
+        elif end is None or p < end:
+          for entry in found:
+            entries.put(entry)
+  print("Scraped %d pages" % (end - first_page))
+
+def list_saved(directory, base_url, workers, entries, run):
+  """ Put entries of pages saved in directory on queue until a page has none """
+  pages = []
+  while os.path.isfile(os.path.join(directory, "%d.html" % (first_page + len(pages)))):
+    pages.append(first_page + len(pages))
+  filenames = [os.path.join(directory, "%d.html" % p) for p in pages]
+  page_urls = [base_url + path + "&page=" + str(p) for p in pages]
+  scraped = 0
+  with run.stage("extract"), \
+       concurrent.futures.ProcessPoolExecutor(workers) as pool:
+    for found in pool.map(extract_file, filenames, page_urls, chunksize=8):
+      if not found:
+        break
+      scraped += 1
+      run.count("pages")
+      run.count("entries", len(found))
+      for entry in found:
+        entries.put(entry)
+  print("Scraped %d saved pages" % scraped)
+
+def list_entries(args, entries, fetcher, run):
+  """ Put entries on queue from saved pages or the site, as args ask """
+  if args.from_html:
+    list_saved(args.from_html, args.base_url, args.listing_workers, entries, run)
+  else:
+    if args.save_html:
+      os.makedirs(args.save_html, exist_ok=True)
+    list_pages(args.base_url, args.listing_workers, entries, fetcher, run,
+               args.save_html)
+
+def download_queue(entries, catalog, fetcher, verify, run):
+  """ Download entries from queue until None """
+  for entry in iter(entries.get, None):
+    try:
+      ## Entries that sanitize to the same name would share a .part
+      with run.stage("download"), file_locks.get(pdf_filename(*entry[:3])):
+        download_entry(*entry, catalog, fetcher, verify)
+    except Exception as e:
+      ## Keep the worker alive, or the bounded queue fills and listing blocks
+      run.count("errors")
+      print("Failed %s: %s" % (entry[3], e))
+
+def main():
+  parser = argparse.ArgumentParser(description="Download PDFs from mises.org")
+  parser.add_argument("-w", "--workers", default=4, type=int,
+                      help="Concurrent downloads (default: 4).")
+  parser.add_argument("-l", "--listing-workers", default=2, type=int,
+                      help="Concurrent listing page requests (default: 2).")
+  parser.add_argument("--base-url", default=base_url,
+                      help="Site to scrape (default: %s)." % base_url)
+  parser.add_argument("--catalog", default=catalog_file,
+                      help="SQLite catalog of downloads (default: %s)." % catalog_file)
+  parser.add_argument("--verify", action="store_true",
+                      help="Check hashes of cataloged files, not only sizes.")
+  parser.add_argument("--cache", default=cache_dir,
+                      help="HTTP cache of listing pages (default: %s)." % cache_dir)
+  parser.add_argument("--save-html", metavar="DIR",
+                      help="Also save listing pages to this directory.")
+  parser.add_argument("--from-html", metavar="DIR",
+                      help="List entries of pages saved by --save-html in this "
+                           "directory instead of fetching them.")
+  parser.add_argument("--list", action="store_true",
+                      help="Print entries instead of downloading them.")
+  metrics.add_arguments(parser)
+  args = parser.parse_args()
+  with metrics.measure("scrape-mises", args) as run:
+    scrape(args, run)
+
+def scrape(args, run):
+  fetcher = fetch.Fetcher(concurrency=args.workers + args.listing_workers,
+                          cache_dir=args.cache)
+  run.attach("fetch", fetcher.metrics.summary)
+  if args.list:
+    entries = queue.Queue()
+    list_entries(args, entries, fetcher, run)
+    while not entries.empty():
+      print("\t".join(entries.get()))
+    return
+  catalog = Catalog(args.catalog)
+  run.attach("downloads", lambda: {"files": throughput.files,
+                                   "bytes": throughput.bytes})
+  entries = queue.Queue(maxsize=args.workers * 4)
+  with concurrent.futures.ThreadPoolExecutor(args.workers) as pool:
+    for _ in range(args.workers):
+      pool.submit(download_queue, entries, catalog, fetcher, args.verify, run)
+    try:
+      list_entries(args, entries, fetcher, run)
+    finally:
+      for _ in range(args.workers):
+        entries.put(None)
+  catalog.close()
+  throughput.report()
+  fetcher.metrics.report(sys.stdout)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,216 @@
+""" scrape-mises.py listing and downloads against a local HTTP stand-in """
+
+import hashlib
+import http.server
+import importlib.util
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+import requests
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+spec = importlib.util.spec_from_file_location(
+    "scrape_mises", os.path.join(root, "scrape-mises.py"))
+scrape_mises = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(scrape_mises)
+
+import fetch  # noqa: E402
+import metrics  # noqa: E402
+
+# Listing pages with results, three entries each
+PAGES = 2
+PDF = b"%PDF-1.4\n" + bytes(range(256)) * 2000
+ETAG = '"%s"' % hashlib.md5(PDF).hexdigest()
+# The same PDF after a change on the server
+CHANGED = b"%PDF-1.5\n" + bytes(range(255, -1, -1)) * 2000
+CHANGED_ETAG = '"%s"' % hashlib.md5(CHANGED).hexdigest()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """ Listing pages and PDFs with ETag, Range, If-Range and 416 support """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, dict(self.headers)))
+        if self.path.startswith("/library/books"):
+            page = int(self.path.rpartition("page=")[2])
+            items = ""
+            for n in range(page * 3, page * 3 + 3) if page < PAGES else ():
+                items += (f'<div class="result-{n % 3}">'
+                          f'<h2 class="teaser-title">Book {n}</h2>'
+                          f'<span class="author">Author {n}</span>'
+                          f'<span class="date">01/0{n + 1}/2001</span>'
+                          f'<a type="application/pdf" href="/pdf/{n}.pdf">'
+                          f'pdf</a></div>')
+            self.reply(200, f"<html><body>{items}</body></html>".encode())
+            return
+        pdf, etag = server.pdf, server.etag
+        if self.headers.get("If-None-Match") == etag:
+            self.reply(304, b"")
+            return
+        start = 0
+        if_range = self.headers.get("If-Range")
+        if self.headers.get("Range") and if_range in (None, etag):
+            start = int(self.headers["Range"].split("=")[1].split("-")[0])
+            if start >= len(pdf):
+                self.reply(416, b"", {"Content-Range": f"bytes */{len(pdf)}"})
+                return
+        body = pdf[start:]
+        headers = {"ETag": etag}
+        if start:
+            headers["Content-Range"] = (f"bytes {start}-{len(pdf) - 1}/"
+                                        f"{len(pdf)}")
+        if server.truncate:
+            # Promise the whole body, send half of it, hang up
+            server.truncate = False
+            self.reply(206 if start else 200, body, headers,
+                       sent=len(body) // 2)
+            self.close_connection = True
+            return
+        self.reply(206 if start else 200, body, headers)
+
+    def reply(self, status, body, headers=None, sent=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body[:sent])
+
+    def log_message(self, *args):
+        pass
+
+
+class TestScrapeMises(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        cls.server.requests = []
+        cls.server.truncate = False
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = "http://127.0.0.1:%d" % cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        self.server.requests.clear()
+        self.server.truncate = False
+        self.server.pdf, self.server.etag = PDF, ETAG
+        self.catalog = scrape_mises.Catalog("mises.db")
+        self.fetcher = fetch.Fetcher(retries=0)
+        self.pdf = self.base_url + "/pdf/0.pdf"
+        self.filename = "2001-01-01_Author_Title.pdf"
+
+    def tearDown(self):
+        self.catalog.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def download(self):
+        scrape_mises.download_entry("Title", "Author", "2001-01-01", self.pdf,
+                                    self.catalog, self.fetcher)
+
+    def pdf_requests(self):
+        return [headers for path, headers in self.server.requests
+                if path.startswith("/pdf/")]
+
+    def test_list_pages(self):
+        entries = queue.Queue()
+        run = metrics.Run("test")
+        scrape_mises.list_pages(self.base_url, 2, entries, self.fetcher, run)
+        found = sorted(entries.queue)
+        self.assertEqual(len(found), PAGES * 3)
+        self.assertEqual(found[0], ("Book0", "Author0", "2001-01-01",
+                                    self.base_url + "/pdf/0.pdf"))
+        self.assertEqual(run.counts["entries"], PAGES * 3)
+
+    def test_download_renames_complete_part(self):
+        self.download()
+        with open(self.filename, "rb") as f:
+            self.assertEqual(f.read(), PDF)
+        self.assertFalse(os.path.exists(self.filename + ".part"))
+        known = self.catalog.get(self.pdf)
+        self.assertEqual(known["size"], len(PDF))
+        self.assertEqual(known["sha256"], hashlib.sha256(PDF).hexdigest())
+        self.assertEqual(known["etag"], ETAG)
+
+    def test_interrupted_download_stays_part_and_resumes(self):
+        self.server.truncate = True
+        with self.assertRaises(requests.RequestException):
+            self.download()
+        self.assertFalse(os.path.exists(self.filename))
+        partial = os.path.getsize(self.filename + ".part")
+        self.assertTrue(0 < partial < len(PDF))
+        self.download()
+        resumed = self.pdf_requests()[-1]
+        self.assertEqual(resumed.get("Range"), "bytes=%d-" % partial)
+        self.assertEqual(resumed.get("If-Range"), ETAG)
+        with open(self.filename, "rb") as f:
+            self.assertEqual(f.read(), PDF)
+        self.assertFalse(os.path.exists(self.filename + ".part"))
+        self.assertEqual(self.catalog.get(self.pdf)["sha256"],
+                         hashlib.sha256(PDF).hexdigest())
+        self.assertIsNone(self.catalog.get_part(self.pdf))
+
+    def test_part_of_changed_file_restarts(self):
+        self.server.truncate = True
+        with self.assertRaises(requests.RequestException):
+            self.download()
+        self.server.pdf, self.server.etag = CHANGED, CHANGED_ETAG
+        self.download()
+        self.assertEqual(self.pdf_requests()[-1].get("If-Range"), ETAG)
+        with open(self.filename, "rb") as f:
+            self.assertEqual(f.read(), CHANGED)
+        self.assertEqual(self.catalog.get(self.pdf)["etag"], CHANGED_ETAG)
+
+    def test_part_without_validator_restarts(self):
+        with open(self.filename + ".part", "wb") as f:
+            f.write(CHANGED[:1000])
+        self.download()
+        self.assertIsNone(self.pdf_requests()[-1].get("Range"))
+        with open(self.filename, "rb") as f:
+            self.assertEqual(f.read(), PDF)
+
+    def test_complete_part_finished_on_416(self):
+        with open(self.filename + ".part", "wb") as f:
+            f.write(PDF)
+        self.catalog.put_part(self.pdf, ETAG, None)
+        self.download()
+        self.assertEqual(self.pdf_requests()[-1].get("Range"),
+                         "bytes=%d-" % len(PDF))
+        with open(self.filename, "rb") as f:
+            self.assertEqual(f.read(), PDF)
+        self.assertFalse(os.path.exists(self.filename + ".part"))
+
+    def test_cataloged_file_revalidated_with_etag(self):
+        self.download()
+        mtime = os.stat(self.filename).st_mtime_ns
+        self.download()
+        self.assertEqual(self.pdf_requests()[-1].get("If-None-Match"), ETAG)
+        self.assertEqual(os.stat(self.filename).st_mtime_ns, mtime)
+
+    def test_truncated_file_fetched_again(self):
+        self.download()
+        with open(self.filename, "r+b") as f:
+            f.truncate(100)
+        self.download()
+        with open(self.filename, "rb") as f:
+            self.assertEqual(f.read(), PDF)
+
+
+if __name__ == "__main__":
+    unittest.main()
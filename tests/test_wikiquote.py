@@ -0,0 +1,76 @@
+""" QuoteParser against the BeautifulSoup parse_quotes() on saved pages """
+
+import glob
+import importlib.util
+import os
+import sys
+import unittest
+
+import bs4
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+fixtures = os.path.join(root, "tests", "fixtures", "wikiquote")
+sys.path.insert(0, root)
+spec = importlib.util.spec_from_file_location(
+    "wikiquote", os.path.join(root, "wikiquote.py"))
+wikiquote = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(wikiquote)
+
+
+def pages():
+    """ Return [(name, content)] of fixture pages """
+    result = []
+    for path in sorted(glob.glob(os.path.join(fixtures, "*.html"))):
+        with open(path, "rb") as f:
+            result.append((os.path.basename(path), f.read()))
+    return result
+
+
+class TestQuoteParser(unittest.TestCase):
+
+    def test_fixtures_exist(self):
+        self.assertGreaterEqual(len(pages()), 2)
+
+    def test_same_quotes_as_bs4(self):
+        for name, content in pages():
+            with self.subTest(page=name):
+                expected = wikiquote.parse_quotes(
+                    bs4.BeautifulSoup(content, "html.parser"))
+                self.assertTrue(expected)
+                self.assertEqual(wikiquote.stream_quotes(content), expected)
+
+    def test_same_quotes_fed_in_chunks(self):
+        # As get_quotes() feeds a page while it downloads
+        for name, content in pages():
+            expected = wikiquote.stream_quotes(content)
+            text = content.decode()
+            for size in (1, 7, 64):
+                with self.subTest(page=name, chunk=size):
+                    parser = wikiquote.QuoteParser()
+                    for start in range(0, len(text), size):
+                        parser.feed(text[start:start + size])
+                        if parser.done:
+                            break
+                    parser.close()
+                    self.assertEqual(parser.quotes, expected)
+
+    def test_stops_at_next_h2(self):
+        for name, content in pages():
+            with self.subTest(page=name):
+                quotes = wikiquote.stream_quotes(content)
+                self.assertFalse(any("Quotes about" in q or "NO" == q.strip()
+                                     or "Not a quote" in q for q in quotes))
+
+    def test_skips_attribution_script_and_style(self):
+        content = dict(pages())["unclosed.html"]
+        quotes = wikiquote.stream_quotes(content)
+        self.assertEqual(quotes[0].strip(),
+                         "Unclosed quote, closed by its list")
+        self.assertEqual(quotes[1].strip(),
+                         "Quote in a paragraph.And a second one.")
+        self.assertEqual(quotes[2].split(), "Quote with a script and a "
+                                            "style.".split())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,7 +4,25 @@
 #   Outputs random quote from list of Wikiquote pages.
 #
 # Requirements:
-#   bs4 (BeautifulSoup) to parse Wikiquote website.
+#   requests (via fetch.py) to fetch Wikiquote website; not imported when
+#   quotes are read from the index (see below). bs4 (BeautifulSoup) for
+#   --compare only.
+#
+# Usage:
+#   $ wikiquote.py              Output random quote.
+#   $ wikiquote.py --harvest    Fetch all pages, write quote index.
+#   $ wikiquote.py --bench      Time startup of wikiquote.py (from index).
+#   $ wikiquote.py --compare page.html ...
+#                               Check QuoteParser against BeautifulSoup on
+#                               saved pages, compare parse times. Sample
+#                               pages are in tests/fixtures/wikiquote, also
+#                               checked by tests/test_wikiquote.py.
+#   $ wikiquote.py --metrics-json FILE [--profile cpu|memory] ...
+#                               Append JSON summary of time spent fetching,
+#                               parsing, writing and reading the index, with
+#                               page/quote counts, to FILE (- for stderr);
+#                               profile with cProfile or tracemalloc. See
+#                               metrics.py.
 #
 # Configuration:
 #   max_length (int)
@@ -21,12 +39,46 @@
 #               ["Robert_Anton_Wilson", "RAW"]
 #            ]
 #
+#   cache_dir (string)
+#       Directory for cached quote lists, one JSON file per page slug.
+#
+#   cache_ttl (int)
+#       Seconds a cached quote list is used before revalidating with
+#       Wikiquote.
+#
+#   index_path (string)
+#       Quote index written by --harvest.
+#
 # How It Works:
-#   BeautifulSoup (BS) does the heavy lifting. Picks a random author from the
-#   pages variable, builds a Wikiquote URL from it, and requests the page
-#   contents from that Wikiquote URL. Parses that Wikiquote page content for
-#   quotes, adds them all to a list, and then selects one at random. Finally,
-#   outputs that quote and its author's name.
+#   Picks a random author from the pages variable, builds a Wikiquote URL from
+#   it, and requests the page contents from that Wikiquote URL. Parses that
+#   Wikiquote page content for quotes, adds them all to a list, and then
+#   selects one at random. Finally, outputs that quote and its author's name.
+#
+#   The page is parsed while it downloads by QuoteParser, an event-driven
+#   html.parser extractor: it skips everything before the second <h2>, only
+#   keeps text of the quote <li> elements (minus their attribution <ul>),
+#   and stops, closing the download, at the next <h2>. parse_quotes() is the
+#   original BeautifulSoup version of the same rules; --compare runs both.
+#
+#   The quote list of each page is cached in cache_dir. Within cache_ttl the
+#   cached list is used as is, with no request and no HTML parsing. After
+#   that the page is requested (through fetch.py, for retries and metrics)
+#   with If-None-Match/If-Modified-Since from the cached ETag/Last-Modified;
+#   a "304 Not Modified" renews the cached list, anything else is parsed and
+#   replaces it. If Wikiquote can't be reached, a stale cached list is used.
+#
+#   --harvest fetches (or revalidates) every page in pages concurrently and
+#   writes all quotes to one index file. Once it exists, quotes are read
+#   from the index only: it's memory-mapped, a random author and one of their
+#   quotes are picked via its offset tables, and requests/bs4 are never
+#   imported. Re-run --harvest from time to time, and after editing pages.
+#
+#   Index layout (little-endian):
+#       "WQI1", author count A, quote count Q         (4s, u32, u32)
+#       A x (first quote, end quote, name offset, name length)   (4 x u32)
+#       Q + 1 x quote offset into text                            (u64)
+#       text: UTF-8 quotes, then author names
 #
 #   Identifying quotes from the Wikiquote page content:
 #       Wikiquote doesn't have a standardized page structure. Based on test
@@ -56,11 +108,19 @@
 #           [etc.]
 #
 
+import codecs
+import html.parser
+import json
+import mmap
+import os
 import random
-import requests
+import struct
+import sys
 import textwrap
+import time
+import types
 
-import bs4
+import metrics
 
 # Configuration
 max_length = 512
@@ -70,6 +130,11 @@ pages = [
             ["Bobby_Fischer", "Bobby Fischer"],
             ["L._Ron_Hubbard", "L. Ron Hubbard"]
         ]
+cache_dir = os.path.join(
+                os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                "wikiquote")
+cache_ttl = 7 * 24 * 60 * 60
+index_path = os.path.join(cache_dir, "index.bin")
 
 # Constants
 base = "https://en.wikiquote.org/wiki/"
@@ -77,17 +142,11 @@ headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) " +
             "AppleWebKit/537.36 (KHTML, like Gecko) " +
             "Chrome/114.0.0.0 Safari/537.36"}
 random_author = random.randrange(len(pages))
-url = base + pages[random_author][0]
+slug = pages[random_author][0]
 
 # Functions
-def get_page(url, headers):
-    """ Return Wikiquote page content """
-    r = requests.get(url=url, headers=headers)
-    soup = bs4.BeautifulSoup(r.content, "html.parser")
-    return soup
-
-def get_quote(soup):
-    """ Return random quote from input Wikiquote page content. """
+def parse_quotes(soup):
+    """ Return list of quotes from input Wikiquote page content. """
     quotes = []
     h2 = soup.find_all("h2")[1]
     for sibling in h2.find_next_siblings():
@@ -101,7 +160,177 @@ def get_quote(soup):
                 pass
             quote = quote.get_text()
             quotes.append(quote)
-    quote = quotes[random.randrange(len(quotes))]
+    return quotes
+
+class QuoteParser(html.parser.HTMLParser):
+    """ Streaming version of parse_quotes(): feed() HTML until done """
+    void = {"area", "base", "br", "col", "embed", "hr", "img", "input",
+            "link", "meta", "param", "source", "track", "wbr"}
+
+    def __init__(self):
+        super().__init__()
+        self.quotes = []
+        self.done = False
+        self.stack = []         # open elements
+        self.h2s = 0
+        self.depth = None       # depth of second <h2> and its siblings
+        self.ul = None          # depth of sibling <ul> being read
+        self.li = None          # depth of its first <li>, the quote
+        self.taken = False      # first <li> of <ul> seen
+        self.skip = None        # depth of first <ul> in <li>, attribution
+        self.skipped = False    # attribution seen
+        self.text = []
+        self.data = []          # text since last tag
+
+    def flush(self):
+        """ Add text since last tag to quote, collapsing whitespace-only
+            strings to one space or newline like BeautifulSoup """
+        if not self.data:
+            return
+        data = "".join(self.data)
+        self.data = []
+        if (not data.strip(" \n\t\f\r")
+                and "pre" not in self.stack and "textarea" not in self.stack):
+            data = "\n" if "\n" in data else " "
+        self.text.append(data)
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        self.flush()
+        depth = len(self.stack)
+        if tag not in self.void:
+            self.stack.append(tag)
+        if self.depth is None:
+            if tag == "h2":
+                self.h2s += 1
+                if self.h2s == 2:
+                    self.depth = depth
+        elif depth == self.depth:
+            if tag == "h2":
+                self.done = True
+            elif tag == "ul":
+                self.ul = depth
+                self.taken = False
+        elif self.ul is not None:
+            if tag == "li" and not self.taken:
+                self.li = depth
+                self.taken = True
+                self.skipped = False
+                self.text = []
+            elif (tag == "ul" and self.li is not None
+                  and self.skip is None and not self.skipped):
+                self.skip = depth
+
+    def handle_endtag(self, tag):
+        if self.done or tag not in self.stack:
+            return
+        self.flush()
+        while True:
+            name = self.stack.pop()
+            depth = len(self.stack)
+            if depth == self.skip:
+                self.skip = None
+                self.skipped = True
+            elif depth == self.li:
+                self.quotes.append("".join(self.text))
+                self.li = None
+            elif depth == self.ul:
+                self.ul = None
+            elif self.depth is not None and depth < self.depth:
+                self.done = True
+            if name == tag:
+                break
+
+    def handle_data(self, data):
+        if (self.li is not None and self.skip is None
+                and self.stack[-1] not in ("script", "style")):
+            self.data.append(data)
+
+    def handle_comment(self, data):
+        self.flush()
+
+    handle_decl = handle_pi = unknown_decl = handle_comment
+
+def load_cache(slug):
+    """ Return cache entry of page slug, or None """
+    try:
+        with open(os.path.join(cache_dir, slug + ".json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_cache(slug, entry):
+    """ Write cache entry of page slug """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, slug + ".json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(entry, f)
+    os.replace(path + ".tmp", path)
+
+def make_fetcher():
+    """ Return fetch.Fetcher for Wikiquote requests """
+    import fetch
+
+    return fetch.Fetcher(headers=headers)
+
+def get_quotes(slug, fetcher, run):
+    """ Return list of quotes of Wikiquote page slug, cached """
+    import requests
+
+    entry = load_cache(slug)
+    if entry and time.time() - entry["fetched"] < cache_ttl:
+        run.count("quotes", len(entry["quotes"]))
+        return entry["quotes"]
+    conditional = {}
+    if entry and entry.get("etag"):
+        conditional["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        conditional["If-Modified-Since"] = entry["last_modified"]
+    try:
+        with run.stage("fetch"):
+            r = fetcher.request("GET", base + slug, headers=conditional,
+                                stream=True)
+        with r:
+            if r.status_code != 304:
+                r.raise_for_status()
+                parser = QuoteParser()
+                decoder = codecs.getincrementaldecoder(
+                              r.encoding or "utf-8")("replace")
+                chunks = r.iter_content(chunk_size=65536)
+                while not parser.done:
+                    with run.stage("fetch"):
+                        chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    with run.stage("parse"):
+                        parser.feed(decoder.decode(chunk))
+                parser.close()
+    except requests.RequestException:
+        if entry:
+            run.count("quotes", len(entry["quotes"]))
+            return entry["quotes"]
+        raise
+    if r.status_code == 304:
+        entry["fetched"] = time.time()
+    else:
+        entry = {
+            "fetched": time.time(),
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "quotes": parser.quotes
+        }
+        run.count("pages")
+    save_cache(slug, entry)
+    run.count("quotes", len(entry["quotes"]))
+    return entry["quotes"]
+
+def get_quote(quotes):
+    """ Return random quote from input list of quotes. """
+    return format_quote(quotes[random.randrange(len(quotes))])
+
+def format_quote(quote):
+    """ Return quote shortened and wrapped for output. """
     quote.strip()
     if len(quote) > max_length:
         quote = textwrap.shorten(quote,
@@ -109,20 +338,177 @@ def get_quote(soup):
     quote = textwrap.fill(quote, width=output_width)
     return quote
 
-def get_author(random_author):
+def get_author(name):
     """ Return name of quote author, aligned right """
-    author = "-- " + pages[random_author][1]
+    author = "-- " + name
     author = author.rjust(output_width)
     return author
 
+def harvest(pages, fetcher, run):
+    """ Fetch quotes of all pages concurrently, write index """
+    import concurrent.futures
+
+    run.attach("fetch", fetcher.metrics.summary)
+    with concurrent.futures.ThreadPoolExecutor(len(pages)) as pool:
+        quote_lists = list(pool.map(
+            lambda page: get_quotes(page[0], fetcher, run), pages))
+    run.mark()
+    texts = [quote.encode() for quotes in quote_lists for quote in quotes]
+    offsets = [0]
+    for text in texts:
+        offsets.append(offsets[-1] + len(text))
+    authors = []
+    names = []
+    first = 0
+    name_offset = offsets[-1]
+    for (slug, name), quotes in zip(pages, quote_lists):
+        if not quotes:
+            # An author without quotes would leave nothing to pick
+            print(f"No quotes found on {slug}, skipped", file=sys.stderr)
+            continue
+        name = name.encode()
+        authors.append((first, first + len(quotes), name_offset, len(name)))
+        names.append(name)
+        first += len(quotes)
+        name_offset += len(name)
+    if not authors:
+        sys.exit("No quotes found, index not written")
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(index_path + ".tmp", "wb") as f:
+        f.write(struct.pack("<4sII", b"WQI1", len(authors), len(texts)))
+        for author in authors:
+            f.write(struct.pack("<4I", *author))
+        f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        f.write(b"".join(texts))
+        f.write(b"".join(names))
+    os.replace(index_path + ".tmp", index_path)
+    run.lap("write")
+    print(f"{len(texts)} quotes from {len(authors)} pages in {index_path}")
+    fetcher.metrics.report()
+
+def read_index(path):
+    """ Return (random quote, its author) from index of random author """
+    with open(path, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        magic, authors, quotes = struct.unpack_from("<4sII", m, 0)
+        if magic != b"WQI1":
+            raise ValueError(f"{path}: not a wikiquote index")
+        first, end, name_offset, name_length = struct.unpack_from(
+            "<4I", m, 12 + 16 * random.randrange(authors))
+        table = 12 + 16 * authors
+        text = table + 8 * (quotes + 1)
+        start, stop = struct.unpack_from(
+            "<2Q", m, table + 8 * random.randrange(first, end))
+        quote = m[text + start:text + stop].decode()
+        name = m[text + name_offset:text + name_offset + name_length].decode()
+    return quote, name
+
+def bench(runs=20):
+    """ Print startup time of wikiquote.py vs. bare interpreter """
+    import subprocess
+
+    for label, command in [("python -c pass", ["-c", "pass"]),
+                           ("wikiquote.py", [__file__])]:
+        times = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            subprocess.run([sys.executable] + command, check=True,
+                           stdout=subprocess.DEVNULL)
+            times.append((time.perf_counter() - started) * 1000)
+        times.sort()
+        print(f"{label}: min {times[0]:.1f} ms, "
+              f"median {times[runs // 2]:.1f} ms, max {times[-1]:.1f} ms")
+
+def compare(paths, runs=5):
+    """ Print whether QuoteParser and parse_quotes() agree on saved pages,
+        and their best parse times """
+    import bs4
+
+    for path in paths:
+        with open(path, "rb") as f:
+            content = f.read()
+        timings = {}
+        for name, parse in [
+                ("bs4", lambda: parse_quotes(
+                    bs4.BeautifulSoup(content, "html.parser"))),
+                ("stream", lambda: stream_quotes(content))]:
+            best = None
+            for _ in range(runs):
+                started = time.perf_counter()
+                quotes = parse()
+                elapsed = (time.perf_counter() - started) * 1000
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = (quotes, best)
+        same = timings["bs4"][0] == timings["stream"][0]
+        print(f"{path}: {len(timings['stream'][0])} quotes, "
+              f"{'same' if same else 'DIFFERENT'}, "
+              f"bs4 {timings['bs4'][1]:.1f} ms, "
+              f"stream {timings['stream'][1]:.1f} ms")
+        if not same:
+            sys.exit(1)
+
+def stream_quotes(content):
+    """ Return list of quotes from page content via QuoteParser """
+    parser = QuoteParser()
+    parser.feed(content.decode("utf-8", "replace"))
+    parser.close()
+    return parser.quotes
+
+def parse_args():
+    """ Return arguments; argparse is only imported if there are any, to
+        keep the plain run from the index fast """
+    if not sys.argv[1:]:
+        return types.SimpleNamespace(harvest=False, bench=False, compare=None,
+                                     metrics_json=None, profile=None)
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Output random quote from Wikiquote pages")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--harvest",
+                      action="store_true",
+                      help="Fetch all pages, write quote index.")
+    mode.add_argument("--bench",
+                      action="store_true",
+                      help="Time startup of wikiquote.py (from index).")
+    mode.add_argument("--compare",
+                      help="Check QuoteParser against BeautifulSoup on saved "
+                           "pages, compare parse times.",
+                      metavar="PAGE",
+                      nargs="+")
+    metrics.add_arguments(parser)
+    return parser.parse_args()
+
 def main():
     """ Prepare variables, call functions, output results. """
-    page = get_page(url, headers)
-    quote = get_quote(page)
-    author = get_author(random_author)
+    args = parse_args()
+    with metrics.measure("wikiquote", args) as run:
+        quote_of_the_run(args, run)
+
+def quote_of_the_run(args, run):
+    """ Run mode asked for by arguments. """
+    if args.compare:
+        compare(args.compare)
+        return
+    if args.harvest:
+        harvest(pages, make_fetcher(), run)
+        return
+    if args.bench:
+        bench()
+        return
+    if os.path.exists(index_path):
+        with run.stage("read"):
+            quote, name = read_index(index_path)
+        quote = format_quote(quote)
+    else:
+        quotes = get_quotes(slug, make_fetcher(), run)
+        quote = get_quote(quotes)
+        name = pages[random_author][1]
+    author = get_author(name)
 
     print(quote)
     print(author)
 
 # Execute
-main()
+if __name__ == "__main__":
+    main()